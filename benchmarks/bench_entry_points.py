@@ -0,0 +1,207 @@
+"""Benchmark of the ``historical``, ``lookup`` and ``projected`` entry points against an nfldb database.
+
+Each entry point is timed (best and median of ``--repeat`` runs),
+its queries and result rows are counted, and its peak Python memory is measured in a separate run.
+Results are written as JSON, which can be compared between commits::
+
+    python benchmarks/bench_entry_points.py --scale season --output before.json
+    git checkout my-branch
+    python benchmarks/bench_entry_points.py --scale season --output after.json
+    python benchmarks/bench_entry_points.py --compare before.json after.json
+
+Without ``--url`` a synthetic database (see ``nfldb_fixture.py``) is generated in a temporary directory.
+
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sqlalchemy import event
+
+import nfldb_fixture
+from nfldata import db, historical, lookup, projected, timeline
+
+# Entry points that run a few queries per row are skipped above these many drives or games.
+max_looped_drives = 2000
+n_sampled_games = 20
+
+
+def cases(engine):
+    """(name, function) pairs; each function takes an engine and returns its result."""
+    games = pd.read_sql_query('SELECT gsis_id, season_year, week, season_type FROM game ORDER BY gsis_id', engine)
+    n_drives = pd.read_sql_query('SELECT count(*) AS n FROM drive', engine)['n'].iloc[0]
+    sampled = games['gsis_id'].iloc[np.linspace(0, len(games) - 1, min(n_sampled_games, len(games))).astype(int)]
+    sampled_seasons = games.loc[sampled.index, 'season_year'].unique()
+    regular = games[games['season_type'] == 'Regular']
+    season_year, week = regular[['season_year', 'week']].iloc[0]
+    tables = dict(game=pd.read_sql_table('game', engine), player=pd.read_sql_table('player', engine))
+    week_projections = nfldb_fixture.projections(tables, season_year, week)
+    player_sample = week_projections[week_projections['Position'] != 'DST'].head(n_sampled_games)
+
+    yield 'historical.player_stats_by_game', lambda engine: historical.player_stats_by_game(engine)
+    yield 'historical.team_stats_by_game', lambda engine: historical.team_stats_by_game(engine)
+    yield 'historical.team_stats_by_drive', lambda engine: historical.team_stats_by_drive(engine)
+    if n_drives <= max_looped_drives:
+        yield 'historical.team_stats_by_drive (loop)', lambda engine: historical.team_stats_by_drive(engine, vectorized=False)
+    yield 'historical.build (games, drives, players)', lambda engine: historical.build(engine)
+    yield 'historical.build (1 week)', lambda engine: historical.build(
+        engine, season_year=int(season_year), week=int(week), season_type='Regular',
+    )
+    yield 'lookup.score_timeline', lambda engine: lookup.score_timeline(engine)
+    yield 'lookup.score_before_time (x{})'.format(len(sampled)), lambda engine: [
+        lookup.score_before_time(engine, gsis_id, 'Q3', 300) for gsis_id in sampled
+    ]
+    yield 'timeline.GameTimelines.build', lambda engine: timeline.GameTimelines.build(engine)
+    yield 'lookup.score_before_time (x{}, timelines)'.format(len(sampled)), lambda engine: [
+        lookup.score_before_time(engine, gsis_id, 'Q3', 300, timelines)
+        for timelines in [timeline.GameTimelines.build(engine, season_year=sampled_seasons)]
+        for gsis_id in sampled
+    ]
+    yield 'lookup.player_id (x{})'.format(len(player_sample)), lambda engine: [
+        lookup.player_id(engine, name, pos, team)
+        for name, pos, team in player_sample[['Player', 'Position', 'Team']].itertuples(index=False)
+    ]
+    yield 'projected.sanitize (1 week)', lambda engine: projected.sanitize(engine, week_projections.copy())
+
+
+def run(url, repeat=3):
+    """Run every case on a new engine and with empty lookup caches each time."""
+    n_queries = [0]
+
+    def count_query(*args):
+        n_queries[0] += 1
+
+    def new_engine():
+        for func in [lookup.gsis_id, lookup.player_id, lookup.player_index]:
+            func.cache.clear()
+        engine = db.connect(url)
+        event.listen(engine, 'before_cursor_execute', count_query)
+        return engine
+
+    results = []
+    for name, func in cases(db.connect(url)):
+        result = dict(name=name)
+        try:
+            times = []
+            for _ in range(repeat):
+                engine = new_engine()
+                n_queries[0] = 0
+                start = time.perf_counter()
+                value = func(engine)
+                times.append(time.perf_counter() - start)
+            result.update(
+                seconds=min(times),
+                median_seconds=statistics.median(times),
+                queries=n_queries[0],
+                rows=_n_rows(value),
+            )
+
+            engine = new_engine()
+            tracemalloc.start()
+            func(engine)
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        except Exception as error:
+            result['error'] = '{}: {}'.format(type(error).__name__, str(error).splitlines()[0] if str(error) else '')
+        finally:
+            tracemalloc.stop()
+        results.append(result)
+        print(_format(result), flush=True)
+    return results
+
+
+def compare(before, after, tolerance=1.2):
+    """Print each entry point's change in time, queries and memory; returns whether any regressed."""
+    before = {result['name']: result for result in before['results']}
+    regressed = False
+    for result in after['results']:
+        old = before.get(result['name'])
+        if old is None:
+            print('{:<44} new'.format(result['name']))
+            continue
+        if 'error' in old or 'error' in result:
+            print('{:<44} {}'.format(result['name'], result.get('error') or old['error']))
+            continue
+        ratios = {
+            key: result[key] / old[key] if old[key] else float(result[key] > 0) + 1
+            for key in ['seconds', 'queries', 'peak_bytes']
+        }
+        slower = ratios['seconds'] > tolerance or ratios['queries'] > 1 or ratios['peak_bytes'] > tolerance
+        regressed |= slower
+        print('{:<44} time x{:.2f}  queries {} -> {}  memory x{:.2f}{}'.format(
+            result['name'], ratios['seconds'], old['queries'], result['queries'], ratios['peak_bytes'],
+            '  REGRESSION' if slower else '',
+        ))
+    return regressed
+
+
+def metadata(url, scale):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        commit=commit,
+        url=url,
+        scale=scale,
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        pandas=pd.__version__,
+        machine=platform.machine(),
+    )
+
+
+def _n_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_n_rows(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(_n_rows(item) for item in value)
+    return 1
+
+
+def _format(result):
+    if 'error' in result:
+        return '{:<44} ERROR {}'.format(result['name'], result['error'])
+    return '{:<44} {:8.3f} s  {:6} queries  {:9,} rows  {:8.1f} MB'.format(
+        result['name'], result['seconds'], result['queries'], result['rows'], result['peak_bytes'] / 2**20,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='SQLAlchemy URL of an nfldb database (default: a generated one)')
+    parser.add_argument('--scale', default='week', choices=sorted(nfldb_fixture.scales))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two JSON results')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='slowdown ratio counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        before, after = [json.load(open(path)) for path in args.compare]
+        sys.exit(compare(before, after, args.tolerance))
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url
+        if url is None:
+            url = 'sqlite:///' + os.path.join(directory, 'nfldb.sqlite')
+            nfldb_fixture.write(nfldb_fixture.generate(**nfldb_fixture.scales[args.scale]), url).dispose()
+        output = dict(meta=metadata(args.url, args.scale), results=run(url, args.repeat))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
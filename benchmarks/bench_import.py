@@ -0,0 +1,61 @@
+"""Benchmark of ``import nfldata`` and of the first call to each reference-data function.
+
+Each measurement is made in a fresh interpreter (median of ``repeat`` runs),
+once with the compiled reference data (see ``nfldata.reference``) and once parsing the YAML files::
+
+    python benchmarks/bench_import.py [repeat]
+
+"""
+import statistics
+import subprocess
+import sys
+
+from nfldata import reference
+
+statements = [
+    ('import nfldata', 'import nfldata', None),
+    ('import nfldata.lookup', 'import nfldata.lookup', None),
+    ('lookup hardcoded ids', 'from nfldata import lookup', 'lookup._get_hardcoded_player_ids()'),
+    ('projected ignored players', 'from nfldata import projected', 'projected.get_ignored_players()'),
+    ('projected column renames', 'from nfldata import projected', 'projected.get_column_renames()'),
+    ('dfs sites', 'from nfldata import dfs', 'dfs.get_sites()'),
+]
+
+script = """
+import time
+start = time.perf_counter()
+{setup}
+setup_seconds = time.perf_counter() - start
+from nfldata import reference
+if not {compiled}:
+    reference._compiled = lambda: {{}}
+start = time.perf_counter()
+{call}
+print(setup_seconds, time.perf_counter() - start)
+"""
+
+
+def measure(setup, call, compiled, repeat=5):
+    """Median seconds of ``setup`` and then of ``call``, each in a new interpreter."""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output([
+            sys.executable, '-c', script.format(setup=setup, call=call or 'pass', compiled=compiled),
+        ])
+        runs.append([float(value) for value in output.split()])
+    return [statistics.median(values) for values in zip(*runs)]
+
+
+def main(repeat=5):
+    print('Wrote {}'.format(reference.build()))
+    print('{:<28} {:>14} {:>14} {:>14}'.format('', 'import ms', 'compiled ms', 'yaml ms'))
+    for name, setup, call in statements:
+        import_seconds, compiled_seconds = measure(setup, call, True, repeat)
+        yaml_seconds = measure(setup, call, False, repeat)[1]
+        print('{:<28} {:14.1f} {:14.2f} {:14.2f}'.format(
+            name, 1e3 * import_seconds, 1e3 * compiled_seconds, 1e3 * yaml_seconds,
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+"""Micro-benchmark of nfldb time parsing and ordering on a million plays.
+
+Compares the per-element ``Quarter`` lookups and string splitting that
+``nfldata.common`` used to do with the current vectorized versions.
+
+    python benchmarks/bench_time_parsing.py [n_plays]
+
+"""
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+
+from nfldata.common import Quarter, process_time_col, is_before, game_clock, time_col_clock
+
+
+def old_process_time_col(series):
+    new_cols = series.str.strip('()').str.split(',', expand=True)
+    return new_cols[0], new_cols[1].astype(int)
+
+
+def old_is_before(quarters, times, quarter, time):
+    quarters = np.array([Quarter[q] for q in quarters])
+    times = np.asarray(times)
+    quarter = Quarter[quarter]
+    return (quarters < quarter) | ((quarters == quarter) & (times < time))
+
+
+def random_times(n_plays, seed=0):
+    random = np.random.RandomState(seed)
+    quarters = random.choice(['Q1', 'Q2', 'Q3', 'Q4', 'OT'], n_plays)
+    seconds = random.randint(0, 901, n_plays)
+    return pd.Series(['({},{})'.format(q, s) for q, s in zip(quarters, seconds)], name='time')
+
+
+def main(n_plays=1000000, repeat=3):
+    times = random_times(n_plays)
+    old_quarters, old_seconds = old_process_time_col(times)
+    quarters, seconds = process_time_col(times)
+    assert (old_is_before(old_quarters, old_seconds, 'Q3', 300) == is_before(quarters, seconds, 'Q3', 300)).all()
+
+    cases = [
+        ('process_time_col (old)', lambda: old_process_time_col(times)),
+        ('process_time_col', lambda: process_time_col(times)),
+        ('is_before (old)', lambda: old_is_before(old_quarters, old_seconds, 'Q3', 300)),
+        ('is_before', lambda: is_before(quarters, seconds, 'Q3', 300)),
+        ('parse + compare (old)',
+         lambda: old_is_before(*old_process_time_col(times), quarter='Q3', time=300)),
+        ('time_col_clock + compare', lambda: time_col_clock(times) < game_clock(['Q3'], [300])[0]),
+    ]
+    print('{:,} plays, best of {}'.format(n_plays, repeat))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('{:<28} {:8.3f} s'.format(name, best))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
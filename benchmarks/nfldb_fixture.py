@@ -0,0 +1,408 @@
+"""Synthetic nfldb-shaped data, for benchmarking without a live nfldb.
+
+Builds the ``game``, ``drive``, ``play``, ``agg_play``, ``play_player`` and ``player`` tables
+with nfldb's column names and text encodings (e.g. ``'(Q2,415)'`` times, ``'(-25)'`` field positions),
+and writes them to any SQLAlchemy URL::
+
+    python benchmarks/nfldb_fixture.py sqlite:///nfldb.sqlite season
+
+Scales are ``week`` (one regular-season week), ``season`` (preseason, regular season and postseason)
+and ``decade`` (ten seasons).
+Drives, plays and box scores follow rough league averages;
+rosters are fixed across seasons and rare plays (safeties, return touchdowns, two-point tries) are left out.
+
+"""
+import sys
+import datetime
+import numpy as np
+import pandas as pd
+
+from nfldata import db, reference
+
+stat_columns = [
+    'defense_frec',
+    'defense_frec_tds',
+    'defense_fgblk',
+    'defense_int',
+    'defense_int_tds',
+    'defense_misc_tds',
+    'defense_puntblk',
+    'defense_safe',
+    'defense_sk',
+    'fumbles_lost',
+    'kicking_fga',
+    'kicking_fgm',
+    'kicking_fgmissed',
+    'kicking_xpa',
+    'kicking_xpmade',
+    'kickret_tds',
+    'passing_att',
+    'passing_cmp',
+    'passing_incmp',
+    'passing_int',
+    'passing_sk',
+    'passing_tds',
+    'passing_twoptm',
+    'passing_yds',
+    'puntret_tds',
+    'receiving_rec',
+    'receiving_tar',
+    'receiving_tds',
+    'receiving_twoptm',
+    'receiving_yds',
+    'rushing_att',
+    'rushing_tds',
+    'rushing_twoptm',
+    'rushing_yds',
+]
+scales = {
+    'week': dict(seasons=1, regular_weeks=1, preseason_weeks=0, postseason_weeks=0),
+    'season': dict(seasons=1),
+    'decade': dict(seasons=10),
+}
+# Players per team by position; offense positions are picked for plays with the given weights.
+roster = [
+    ('QB', [0.97, 0.03]),
+    ('RB', [0.55, 0.3, 0.1, 0.05]),
+    ('FB', [1]),
+    ('WR', [0.3, 0.25, 0.2, 0.1, 0.1, 0.05]),
+    ('TE', [0.7, 0.25, 0.05]),
+    ('K', [1]),
+    ('DE', [0.25] * 4),
+    ('DT', [0.25] * 4),
+    ('LB', [0.2] * 5),
+    ('CB', [0.2] * 5),
+    ('SS', [0.5] * 2),
+    ('FS', [0.5] * 2),
+]
+free_agents = 300
+first_names = ['Aaron', 'Adrian', 'Alex', 'Andre', 'Antonio', 'Ben', 'Brandon', 'Calvin', 'Cam', 'Chris',
+               'Dan', 'David', 'DeMarco', 'Derek', 'Eli', 'Eric', 'Greg', 'Jamaal', 'James', 'Jason',
+               'Jordan', 'Josh', 'Julio', 'Justin', 'Kevin', 'Larry', 'Marcus', 'Mark', 'Matt', 'Michael',
+               'Mike', 'Philip', 'Russell', 'Ryan', 'Steve', 'Terrell', 'Tom', 'Tony', 'Travis', 'Tyler']
+last_names = ['Allen', 'Bell', 'Brady', 'Brown', 'Bryant', 'Carr', 'Charles', 'Cooper', 'Davis', 'Evans',
+              'Foster', 'Gordon', 'Graham', 'Green', 'Harris', 'Hill', 'Jackson', 'Johnson', 'Jones', 'Kelce',
+              'Lewis', 'Manning', 'Martin', 'Miller', 'Moore', 'Murray', 'Newton', 'Nelson', 'Peterson', 'Rivers',
+              'Rodgers', 'Sanders', 'Smith', 'Stafford', 'Taylor', 'Thomas', 'Walker', 'White', 'Williams', 'Wilson']
+
+
+def generate(seasons=1, first_season=2009, regular_weeks=17, preseason_weeks=4, postseason_weeks=4, seed=0):
+    """A dict of nfldb table name to frame."""
+    random = np.random.RandomState(seed)
+    teams = get_teams()
+    player = _players(random, teams)
+    game = _games(random, teams, seasons, first_season, preseason_weeks, regular_weeks, postseason_weeks)
+    drive, play = _drives_and_plays(random, game)
+    play_player = _play_players(random, play, game, player, teams)
+    player = player.drop('depth', axis=1)
+
+    keys = ['gsis_id', 'drive_id', 'play_id']
+    agg_play = (play_player.groupby(keys)[stat_columns].sum()
+                .reindex(pd.MultiIndex.from_frame(play[keys]), fill_value=0)
+                .reset_index()
+                )
+    game = _final_scores(game, play, agg_play)
+    drive['play_count'] = play.groupby(['gsis_id', 'drive_id']).size().values
+    return dict(game=game, drive=drive, play=play, agg_play=agg_play, play_player=play_player, player=player)
+
+
+def write(tables, url):
+    """Write ``tables`` to the database at ``url``, replacing them, with nfldb's key indexes."""
+    engine = db.connect(url)
+    with engine.begin() as connection:
+        for name, frame in tables.items():
+            frame.to_sql(name, connection, if_exists='replace', index=False, chunksize=50000)
+    db.create_indexes(engine, list(tables))
+    return engine
+
+
+def projections(tables, season_year, week, season_type='Regular', seed=0):
+    """A raw weekly projections frame, as ``projected.load_by_week`` passes to ``sanitize``, for every team playing that week."""
+    random = np.random.RandomState(seed)
+    game = tables['game']
+    game = game[(game['season_year'] == season_year) & (game['week'] == week) & (game['season_type'] == season_type)]
+    teams = pd.concat([game['home_team'], game['away_team']]).values
+    player = tables['player']
+    player = player[player['team'].isin(teams) & player['position'].isin(['QB', 'RB', 'WR', 'TE', 'K'])]
+
+    n = len(player)
+    frame = pd.DataFrame({
+        'Player': player['full_name'].values,
+        'Position': player['position'].values,
+        'Team': player['team'].values,
+        'PassYds': np.where(player['position'] == 'QB', random.gamma(20, 12, n), 0).round(1),
+        'PassTDs': np.where(player['position'] == 'QB', random.gamma(4, 0.4, n), 0).round(2),
+        'RushYds': np.where(player['position'].isin(['RB', 'QB']), random.gamma(2, 15, n), 0).round(1),
+        'RecYds': np.where(player['position'].isin(['WR', 'TE', 'RB']), random.gamma(2, 15, n), 0).round(1),
+        'FFPts': random.gamma(2, 5, n).round(2),
+        'Salary': 100 * random.randint(30, 95, n),
+    })
+    dst = pd.DataFrame({
+        'Player': [get_team_names()[team] for team in teams],
+        'Position': 'DST',
+        'Team': teams,
+        'FFPts': random.gamma(4, 2, len(teams)).round(2),
+        'Salary': 100 * random.randint(20, 40, len(teams)),
+    })
+    return pd.concat([frame, dst], ignore_index=True).assign(season_year=season_year, week=week, season_type=season_type)
+
+
+def get_teams():
+    return [variations[0] for variations in _get_team_variations()]
+
+
+def get_team_names():
+    return {variations[0]: variations[2] for variations in _get_team_variations()}
+
+
+def _get_team_variations():
+    return reference.load('teams')
+
+
+def _players(random, teams):
+    rows = []
+    for team in teams:
+        for pos, weights in roster:
+            rows.extend((team, pos, depth) for depth in range(len(weights)))
+    rows.extend(('UNK', random.choice([pos for pos, _ in roster]), 0) for _ in range(free_agents))
+    player = pd.DataFrame(rows, columns=['team', 'position', 'depth'])
+    player['first_name'] = random.choice(first_names, len(player))
+    player['last_name'] = random.choice(last_names, len(player))
+    # Players sharing a name get suffixes, so projections resolve to one player.
+    repeats = player.groupby(['first_name', 'last_name']).cumcount().values
+    player['last_name'] += np.where(repeats > 0, [' ' + 'I' * (repeat + 1) for repeat in repeats], '')
+    player['full_name'] = player['first_name'] + ' ' + player['last_name']
+    player['gsis_name'] = player['first_name'].str[0] + '.' + player['last_name']
+    player['player_id'] = ['00-00{:05d}'.format(20000 + i) for i in range(len(player))]
+    unknown_position = (player['team'] == 'UNK').values & (random.rand(len(player)) < 0.3)
+    player.loc[unknown_position, 'position'] = 'UNK'
+    player['uniform_number'] = random.randint(1, 100, len(player))
+    player['years_pro'] = random.randint(0, 15, len(player))
+    player['status'] = np.where(player['team'] == 'UNK', 'Unknown', 'Active')
+    return player[['player_id', 'gsis_name', 'full_name', 'first_name', 'last_name', 'team', 'position',
+                   'uniform_number', 'years_pro', 'status', 'depth']]
+
+
+def _games(random, teams, seasons, first_season, preseason_weeks, regular_weeks, postseason_weeks):
+    rows = []
+    for season_year in range(first_season, first_season + seasons):
+        first_sunday = datetime.date(season_year, 9, 7) + datetime.timedelta(days=(6 - datetime.date(season_year, 9, 7).weekday()))
+        weeks = (
+            [('Preseason', week, first_sunday - datetime.timedelta(weeks=preseason_weeks - week), len(teams) // 2)
+             for week in range(preseason_weeks)]
+            + [('Regular', week, first_sunday + datetime.timedelta(weeks=week - 1), len(teams) // 2)
+               for week in range(1, regular_weeks + 1)]
+            + [('Postseason', week, first_sunday + datetime.timedelta(weeks=regular_weeks + week - 1),
+                max(1, 4 >> max(0, week - 2)))
+               for week in range(1, postseason_weeks + 1)]
+        )
+        for season_type, week, date, n_games in weeks:
+            order = random.permutation(teams)[:2 * n_games]
+            for number, (home_team, away_team) in enumerate(zip(order[::2], order[1::2])):
+                rows.append(dict(
+                    gsis_id='{:%Y%m%d}{:02d}'.format(date, number),
+                    gamekey=str(50000 + len(rows)),
+                    start_time=datetime.datetime.combine(date, datetime.time(13 + 3 * (number % 3))),
+                    week=week,
+                    day_of_week='Sunday',
+                    season_year=season_year,
+                    season_type=season_type,
+                    finished=True,
+                    home_team=home_team,
+                    away_team=away_team,
+                ))
+    return pd.DataFrame(rows)
+
+
+def _drives_and_plays(random, game):
+    n_drives = 2 * random.randint(10, 14, len(game))
+    drive = pd.DataFrame(dict(
+        gsis_id=np.repeat(game['gsis_id'].values, n_drives),
+        drive_id=np.concatenate([np.arange(1, n + 1) for n in n_drives]),
+    ))
+    home_first = np.repeat(random.rand(len(game)) < 0.5, n_drives)
+    home_has_ball = (drive['drive_id'].values % 2 == 1) == home_first
+    drive['pos_team'] = np.where(
+        home_has_ball,
+        np.repeat(game['home_team'].values, n_drives),
+        np.repeat(game['away_team'].values, n_drives),
+    )
+    drive['result'] = random.choice(
+        ['Touchdown', 'Field Goal', 'Punt', 'Interception', 'Fumble', 'Downs'],
+        len(drive), p=[0.22, 0.16, 0.42, 0.08, 0.05, 0.07],
+    )
+
+    # Plays within a drive; the last decides the result, and touchdowns get an extra point try.
+    n_plays = 1 + random.poisson(5, len(drive))
+    drive_ix = np.repeat(np.arange(len(drive)), n_plays)
+    is_last = np.r_[drive_ix[1:] != drive_ix[:-1], True]
+    result = drive['result'].values[drive_ix]
+    play_type = np.where(random.rand(len(drive_ix)) < 0.57, 'pass', 'run')
+    play_type[is_last & (result == 'Field Goal')] = 'field_goal'
+    play_type[is_last & (result == 'Punt')] = 'punt'
+    play_type[is_last & (result == 'Interception')] = 'pass'
+    play_type[is_last & (result == 'Fumble')] = 'run'
+
+    extra_point = np.flatnonzero(is_last & (result == 'Touchdown'))
+    order = np.argsort(np.r_[np.arange(len(drive_ix)), extra_point + 0.5], kind='mergesort')
+    drive_ix = np.r_[drive_ix, drive_ix[extra_point]][order]
+    play_type = np.r_[play_type, ['extra_point'] * len(extra_point)][order]
+    outcome = np.r_[np.where(is_last, result, ''), [''] * len(extra_point)][order]
+
+    play = pd.DataFrame(dict(
+        gsis_id=drive['gsis_id'].values[drive_ix],
+        drive_id=drive['drive_id'].values[drive_ix],
+        pos_team=drive['pos_team'].values[drive_ix],
+        play_type=play_type,
+        outcome=outcome,
+    ))
+    in_game = play.groupby('gsis_id').cumcount().values
+    game_plays = play.groupby('gsis_id')['gsis_id'].transform('size').values
+    play['play_id'] = 36 + 22 * in_game
+    play.loc[play['play_type'] == 'extra_point', 'play_id'] -= 11
+
+    # Spread the plays evenly over four quarters; extra points share their touchdown's clock.
+    seconds = (3599 * (in_game - (play['play_type'] == 'extra_point').values) / game_plays).astype(int)
+    quarters = np.array(['Q1', 'Q2', 'Q3', 'Q4'])[seconds // 900]
+    play['time'] = ['({},{})'.format(quarter, second) for quarter, second in zip(quarters, seconds % 900)]
+    play['down'] = np.where(play['play_type'] == 'extra_point', 0, random.randint(1, 5, len(play)))
+    play['yards_to_go'] = np.where(play['down'] > 0, random.randint(1, 16, len(play)), 0)
+    play['yardline'] = ['({})'.format(yardline) for yardline in random.randint(-49, 50, len(play))]
+    play['description'] = play['play_type'].str.replace('_', ' ')
+
+    first, last = play.groupby(['gsis_id', 'drive_id']).nth(0), play.groupby(['gsis_id', 'drive_id']).nth(-1)
+    drive['start_time'] = first['time'].values
+    drive['end_time'] = last['time'].values
+    drive['start_field'] = ['({})'.format(field) for field in random.randint(-45, 10, len(drive))]
+    drive['end_field'] = ['({})'.format(field) for field in random.randint(-20, 50, len(drive))]
+    drive['pos_time'] = ['({})'.format(seconds) for seconds in 25 * n_plays + random.randint(0, 60, len(drive))]
+    drive['first_downs'] = random.binomial(n_plays, 0.25)
+    drive['yards_gained'] = np.maximum(6 * n_plays + random.randint(-15, 15, len(drive)), -10)
+    drive['penalty_yards'] = 5 * random.poisson(0.5, len(drive))
+    return drive, play
+
+
+def _play_players(random, play, game, player, teams):
+    """One row per player per play with that player's stats."""
+    team_ix = pd.Series(np.arange(len(teams)), index=teams)
+    defense_team = _opponents(play, game)
+    offense = team_ix.reindex(play['pos_team']).values
+    defense = team_ix.reindex(defense_team).values
+    on_team = player[player['team'] != 'UNK']
+    rosters = {
+        pos: on_team[on_team['position'] == pos].pivot(index='team', columns='depth', values='player_id').reindex(teams).values
+        for pos, _ in roster
+    }
+    weights = dict(roster)
+
+    def pick(positions, team, rows):
+        """Random players of the given positions (weighted by depth) from each row's team."""
+        ids = np.column_stack([rosters[pos] for pos in positions])
+        p = np.concatenate([weights[pos] for pos in positions])
+        return ids[team[rows], random.choice(len(p), len(rows), p=p / p.sum())]
+
+    def rows_for(rows, player_ids, side, **stats):
+        frame = play.iloc[rows][['gsis_id', 'drive_id', 'play_id']].reset_index(drop=True)
+        frame['player_id'] = player_ids
+        frame['team'] = (play['pos_team'] if side == 'offense' else defense_team).values[rows]
+        for stat, values in stats.items():
+            frame[stat] = values
+        return frame
+
+    play_type, outcome = play['play_type'].values, play['outcome'].values
+    frames = []
+
+    passes = np.flatnonzero(play_type == 'pass')
+    intercepted = outcome[passes] == 'Interception'
+    pass_tds = outcome[passes] == 'Touchdown'
+    sacked = (random.rand(len(passes)) < 0.065) & ~intercepted & ~pass_tds
+    thrown = ~sacked
+    completed = thrown & ~intercepted & ((random.rand(len(passes)) < 0.64) | pass_tds)
+    pass_yds = np.where(completed, np.round(random.gamma(1.6, 7, len(passes))).astype(int), 0)
+    frames.append(rows_for(
+        passes, pick(['QB'], offense, passes), 'offense',
+        passing_att=thrown.astype(int),
+        passing_cmp=completed.astype(int),
+        passing_incmp=(thrown & ~completed & ~intercepted).astype(int),
+        passing_int=intercepted.astype(int),
+        passing_sk=sacked.astype(int),
+        passing_yds=pass_yds,
+        passing_tds=pass_tds.astype(int),
+    ))
+    targets = passes[thrown & ~intercepted]
+    target_completed, target_tds = completed[thrown & ~intercepted], pass_tds[thrown & ~intercepted]
+    frames.append(rows_for(
+        targets, pick(['WR', 'TE', 'RB'], offense, targets), 'offense',
+        receiving_tar=1,
+        receiving_rec=target_completed.astype(int),
+        receiving_yds=pass_yds[thrown & ~intercepted],
+        receiving_tds=target_tds.astype(int),
+    ))
+    sacks = passes[sacked]
+    frames.append(rows_for(sacks, pick(['DE', 'DT', 'LB'], defense, sacks), 'defense', defense_sk=1))
+    interceptions = passes[intercepted]
+    frames.append(rows_for(
+        interceptions, pick(['CB', 'SS', 'FS', 'LB'], defense, interceptions), 'defense',
+        defense_int=1,
+        defense_int_tds=(random.rand(len(interceptions)) < 0.1).astype(int),
+    ))
+
+    runs = np.flatnonzero(play_type == 'run')
+    fumbled = outcome[runs] == 'Fumble'
+    frames.append(rows_for(
+        runs, pick(['RB', 'FB', 'QB', 'WR'], offense, runs), 'offense',
+        rushing_att=1,
+        rushing_yds=np.clip(np.round(random.normal(4.2, 6, len(runs))), -8, 99).astype(int),
+        rushing_tds=(outcome[runs] == 'Touchdown').astype(int),
+        fumbles_lost=fumbled.astype(int),
+    ))
+    fumbles = runs[fumbled]
+    frames.append(rows_for(fumbles, pick(['DE', 'DT', 'LB', 'CB'], defense, fumbles), 'defense', defense_frec=1))
+
+    kicks = np.flatnonzero(np.isin(play_type, ['field_goal', 'extra_point']))
+    is_fg = play_type[kicks] == 'field_goal'
+    made = random.rand(len(kicks)) < np.where(is_fg, 0.84, 0.95)
+    frames.append(rows_for(
+        kicks, pick(['K'], offense, kicks), 'offense',
+        kicking_fga=is_fg.astype(int),
+        kicking_fgm=(is_fg & made).astype(int),
+        kicking_fgmissed=(is_fg & ~made).astype(int),
+        kicking_xpa=(~is_fg).astype(int),
+        kicking_xpmade=(~is_fg & made).astype(int),
+    ))
+
+    play_player = pd.concat(frames, ignore_index=True)
+    play_player[stat_columns] = play_player.reindex(columns=stat_columns).fillna(0).astype(int)
+    return (play_player[['gsis_id', 'drive_id', 'play_id', 'player_id', 'team'] + stat_columns]
+            .sort_values(['gsis_id', 'drive_id', 'play_id'], kind='mergesort')
+            .reset_index(drop=True)
+            )
+
+
+def _opponents(play, game):
+    games = game.set_index('gsis_id')
+    home_team = games['home_team'].reindex(play['gsis_id']).values
+    away_team = games['away_team'].reindex(play['gsis_id']).values
+    return pd.Series(np.where(play['pos_team'].values == home_team, away_team, home_team), index=play.index)
+
+
+def _final_scores(game, play, agg_play):
+    points = (6 * (agg_play['passing_tds'] + agg_play['rushing_tds'])
+              + 3 * agg_play['kicking_fgm'] + agg_play['kicking_xpmade'])
+    defense_points = 6 * agg_play['defense_int_tds']
+    scored = pd.concat([
+        pd.DataFrame(dict(gsis_id=play['gsis_id'], team=play['pos_team'], points=points.values)),
+        pd.DataFrame(dict(gsis_id=play['gsis_id'], team=_opponents(play, game).values, points=defense_points.values)),
+    ]).groupby(['gsis_id', 'team'])['points'].sum()
+    game = game.copy()
+    game['home_score'] = scored.reindex(pd.MultiIndex.from_arrays([game['gsis_id'], game['home_team']]), fill_value=0).values
+    game['away_score'] = scored.reindex(pd.MultiIndex.from_arrays([game['gsis_id'], game['away_team']]), fill_value=0).values
+    return game
+
+
+if __name__ == '__main__':
+    url = sys.argv[1]
+    scale = sys.argv[2] if len(sys.argv) > 2 else 'season'
+    tables = generate(**scales[scale])
+    write(tables, url)
+    print(', '.join('{}: {:,} rows'.format(name, len(frame)) for name, frame in tables.items()))
@@ -1,9 +1,21 @@
 from glob import glob
 from os.path import splitext, basename, join
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py as _build_py
 
 exec(open(join('src', 'nfldata', '__version__.py')).read())
 
+
+class build_py(_build_py):
+    """Also compile the YAML reference data into ``data/reference.pickle``."""
+    def run(self):
+        super().run()
+        if not self.dry_run:
+            import sys
+            sys.path.insert(0, self.build_lib)
+            from nfldata import reference
+            reference.build(join(self.build_lib, 'nfldata', 'data'))
+
 setup(
     name='nfldata',
     version=__version__,
@@ -26,8 +38,16 @@ setup(
         'pyyaml',
         'sqlalchemy',
     ],
+    extras_require={
+        'cache': ['pyarrow'],
+        'duckdb': ['duckdb', 'duckdb_engine'],
+    },
+    entry_points={
+        'console_scripts': ['nfldb-snapshot = nfldata.db:main'],
+    },
 
     package_data={
         'nfldata': ['data/*.yaml'],
     },
+    cmdclass={'build_py': build_py},
 )
@@ -1,2 +1,32 @@
+from importlib import import_module
+
 from nfldata.__version__ import __version__
-from nfldata import historical, lookup, projected, stats
+
+# Submodules are imported on first access, so ``import nfldata`` doesn't pay for pandas and SQLAlchemy.
+submodules = [
+    'cache',
+    'common',
+    'db',
+    'dfs',
+    'features',
+    'historical',
+    'lookup',
+    'names',
+    'projected',
+    'reference',
+    'scoring',
+    'simulate',
+    'stats',
+    'timeline',
+    'trace',
+]
+
+
+def __getattr__(name):
+    if name in submodules:
+        return import_module('nfldata.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(submodules))
@@ -0,0 +1,299 @@
+"""Caches of nfldb results: a persistent on-disk cache of query results,
+and bounded in-memory caches of ``lookup`` results.
+
+Results are stored as Parquet files (requires ``pyarrow``),
+keyed by the SQL text, its parameters, the read options,
+and a fingerprint of every table the query reads.
+Fingerprints are a row count and maximum key per table,
+so appending games to nfldb invalidates the affected entries.
+
+Use a cache as a context manager to route every query
+in ``historical`` and ``lookup`` through it::
+
+    with QueryCache('~/.cache/nfldata', max_bytes=2 * 2**30) as query_cache:
+        games = historical.team_stats_by_game(connection)
+    print(query_cache.hits, query_cache.misses)
+
+Both key results on the database's identity (see ``database_identity``) rather than the connection object,
+so new or pooled connections to the same database share entries.
+
+"""
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha1
+import inspect
+import json
+import os
+import threading
+import time
+import weakref
+import pandas as pd
+
+_active = []
+
+
+def active():
+    """The innermost cache currently in use, or None."""
+    return _active[-1] if _active else None
+
+
+class QueryCache:
+    index_file = 'index.json'
+
+    def __init__(self, directory, max_bytes=2**30, fingerprint_ttl=60):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.fingerprint_ttl = fingerprint_ttl
+        self.hits = 0
+        self.misses = 0
+        self._fingerprints = {}
+        self._lock = threading.RLock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = self._read_index()
+        # The directory may have been filled under a larger ``max_bytes``.
+        if self.size > self.max_bytes:
+            self._evict()
+            self._write_index()
+
+    def __enter__(self):
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.remove(self)
+
+    @property
+    def size(self):
+        return sum(entry['size'] for entry in self._index.values())
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self._index),
+            size=self.size,
+        )
+
+    def read(self, connection, sql, params, tables, load, **kwargs):
+        """Return the cached result of a query, calling ``load`` to run it on a miss.
+
+        Only databases named by a URL are cached, since entries outlive the process;
+        queries of in-memory databases or DBAPI connections always call ``load``.
+
+        """
+        if not isinstance(database_identity(connection), str):
+            return load()
+        key = self._key(connection, sql, params, tables, kwargs)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and os.path.exists(self._path(key)):
+                self.hits += 1
+                entry['last_access'] = time.time()
+                self._write_index()
+                return pd.read_parquet(self._path(key))
+            self.misses += 1
+
+        # Concurrent reads (see ``db.submit``) run their queries outside the lock.
+        result = load()
+        with self._lock:
+            result.to_parquet(self._path(key))
+            self._index[key] = dict(
+                tables=sorted(tables),
+                size=os.path.getsize(self._path(key)),
+                last_access=time.time(),
+            )
+            self._evict()
+            self._write_index()
+        return result
+
+    def invalidate(self, tables=None):
+        """Drop every entry, or only those reading any of ``tables``."""
+        with self._lock:
+            for key, entry in list(self._index.items()):
+                if tables is None or set(entry['tables']) & set(tables):
+                    self._remove(key)
+            self._fingerprints.clear()
+            self._write_index()
+
+    def fingerprint(self, connection, table):
+        db = database_identity(connection)
+        fetched_at, fingerprint = self._fingerprints.get((db, table), (None, None))
+        if fetched_at is None or time.time() - fetched_at > self.fingerprint_ttl:
+            fingerprint = _table_fingerprint(connection, table)
+            self._fingerprints[db, table] = time.time(), fingerprint
+        return fingerprint
+
+    def _key(self, connection, sql, params, tables, kwargs):
+        return sha1(json.dumps([
+            database_identity(connection),
+            ' '.join(sql.split()),
+            sorted((params or {}).items()),
+            sorted(kwargs.items()),
+            [(table, self.fingerprint(connection, table)) for table in sorted(tables)],
+        ], default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.parquet')
+
+    def _evict(self):
+        by_age = sorted(self._index, key=lambda key: self._index[key]['last_access'])
+        while self.size > self.max_bytes and len(by_age) > 1:
+            self._remove(by_age.pop(0))
+
+    def _remove(self, key):
+        del self._index[key]
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, self.index_file)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self):
+        path = os.path.join(self.directory, self.index_file)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._index, f)
+        os.replace(path + '.tmp', path)
+
+
+def _table_fingerprint(connection, table):
+    key = 'player_id' if table == 'player' else 'gsis_id'
+    return pd.read_sql_query(
+        'SELECT count(*) AS n, max({}) AS last FROM {}'.format(key, table),
+        connection,
+    ).iloc[0, :].tolist()
+
+
+class LookupCache:
+    """A thread-safe LRU cache with an optional time to live (in seconds)."""
+
+    def __init__(self, maxsize=4096, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """A ``(found, value)`` pair."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] <= self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = time.monotonic(), value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else None,
+            evictions=self.evictions,
+            size=len(self._entries),
+            maxsize=self.maxsize,
+        )
+
+
+def memoize_lookup(maxsize=4096, ttl=None, ignore=()):
+    """Memoize a function of ``(connection, ...)`` in a ``LookupCache``, keyed on the database identity.
+
+    Arguments named in ``ignore`` (e.g. ones only used in error messages) are left out of the key.
+    Exceptions are not cached, and pandas results are copied on the way out,
+    so callers cannot change what is cached.
+    The wrapper has ``cache``, ``key(connection, *args, **kwargs)``,
+    and ``preload(value, connection, *args, **kwargs)`` to fill an entry without calling the function.
+
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        cache = LookupCache(maxsize, ttl)
+
+        def key(connection, *args, **kwargs):
+            bound = signature.bind(connection, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.items())[1:]
+            return (database_identity(connection),) + tuple(
+                (name, value) for name, value in arguments if name not in ignore
+            )
+
+        @wraps(func)
+        def wrapper(connection, *args, **kwargs):
+            cache_key = key(connection, *args, **kwargs)
+            if cache_key[0] is None:
+                return func(connection, *args, **kwargs)
+            found, value = cache.get(cache_key)
+            if not found:
+                value = func(connection, *args, **kwargs)
+                cache.put(cache_key, value)
+            return _copied(value)
+
+        def preload(value, connection, *args, **kwargs):
+            cache_key = key(connection, *args, **kwargs)
+            if cache_key[0] is not None:
+                cache.put(cache_key, value)
+
+        wrapper.cache = cache
+        wrapper.key = key
+        wrapper.preload = preload
+        return wrapper
+    return decorator
+
+
+def database_identity(connection):
+    """The URL of a SQLAlchemy engine or connection's database, if it names one that outlives the engine,
+    with SQLite and DuckDB paths made absolute.
+
+    For an in-memory database or a DBAPI connection, a weak reference to the engine or connection instead,
+    which matches nothing once it is gone, or None if it cannot be weakly referenced (and so cannot be cached).
+
+    """
+    engine = getattr(connection, 'engine', None)
+    if engine is not None and not in_memory(engine.url):
+        url = engine.url
+        if url.get_backend_name() in {'sqlite', 'duckdb'} and not url.query.get('uri'):
+            # Relative paths name a different database in every working directory.
+            url = url.set(database=os.path.abspath(url.database))
+        return str(url)
+    try:
+        return weakref.ref(engine if engine is not None else connection)
+    except TypeError:
+        return None
+
+
+def in_memory(url):
+    """Whether a SQLAlchemy URL names an in-memory SQLite or DuckDB database, private to the engine that opens it."""
+    return url.get_backend_name() in {'sqlite', 'duckdb'} and (
+        url.database in {None, '', ':memory:'} or url.query.get('mode') == 'memory'
+    )
+
+
+def _copied(value):
+    return value.copy() if isinstance(value, (pd.Series, pd.DataFrame)) else value
@@ -1,5 +1,6 @@
 from enum import IntEnum
 import numpy as np
+import pandas as pd
 
 
 class Quarter(IntEnum):
@@ -19,16 +20,143 @@ class Quarter(IntEnum):
         return self.name
 
 
+quarter_names = np.array([q.name for q in Quarter], dtype=object)
+
+# Each quarter spans this many ticks of the game clock,
+# enough that the end of a quarter (900 seconds elapsed) sorts before the start of the next.
+clock_ticks_per_quarter = 1000
+
+
+def quarter_codes(quarters):
+    """``Quarter`` codes (as int8) for an array of quarter names."""
+    codes = pd.Categorical(np.asarray(quarters, dtype=object), categories=quarter_names).codes
+    if (codes < 0).any():
+        raise ValueError('Unknown quarters: {}'.format(set(np.asarray(quarters, dtype=object)[codes < 0])))
+    return codes.astype(np.int8)
+
+
+def game_clock(quarters, times):
+    """Game-clock ordinals: a single integer that orders times within a game.
+
+    ``quarters`` are names (see ``Quarter``) and ``times`` are seconds elapsed in the quarter.
+
+    """
+    return (quarter_codes(quarters).astype(np.int64) * clock_ticks_per_quarter
+            + np.asarray(times, dtype=np.int64))
+
+
+def parse_time_col(series):
+    """Quarter codes and elapsed seconds, as int arrays, from nfldb ``(Q1,123)`` time strings.
+
+    Each distinct string is parsed once; there are only a few thousand.
+
+    """
+    codes, uniques = pd.factorize(np.asarray(series, dtype=object))
+    if (codes < 0).any():
+        raise ValueError('Missing times in {}'.format(getattr(series, 'name', 'times')))
+    parts = [str_.strip('()').split(',') for str_ in uniques]
+    unique_quarters = quarter_codes([quarter for quarter, _ in parts])
+    unique_times = np.array([int(time) for _, time in parts], dtype=np.int64)
+    return unique_quarters[codes], unique_times[codes]
+
+
+def time_col_clock(series):
+    """Game-clock ordinals straight from nfldb time strings."""
+    quarters, times = parse_time_col(series)
+    return quarters.astype(np.int64) * clock_ticks_per_quarter + times
+
+
 def process_time_col(series):
-    new_cols = series.str.strip('()').str.split(',', expand=True)
+    quarters, times = parse_time_col(series)
     return (
-        new_cols[0],
-        new_cols[1].astype(int),
+        pd.Series(quarter_names[quarters], index=series.index, name=series.name),
+        pd.Series(times, index=series.index, name=series.name),
     )
 
 
 def is_before(quarters, times, quarter, time):
-    quarters = np.array([Quarter[q] for q in quarters])
-    times = np.asarray(times)
-    quarter = Quarter[quarter]
-    return (quarters < quarter) | ((quarters == quarter) & (times < time))
+    return game_clock(quarters, times) < game_clock([quarter], [time])[0]
+
+
+# Schema of frames returned with ``compact=True``:
+#   - ``compact_categorical`` columns and index levels are categoricals;
+#   - ``compact_quarters`` columns are int8 ``Quarter`` codes;
+#   - ``compact_int16`` columns, and any column ending in ``_yds``, are int16;
+#   - every other integral column (the per-game and per-drive counts) is int8;
+#   - integral columns with nulls use the nullable equivalents (Int8, Int16);
+#   - other floats are float32, and remaining columns are unchanged.
+# Values that do not fit their compact dtype raise a ValueError rather than overflowing.
+compact_categorical = {'gsis_id', 'player_id', 'team', 'pos_team', 'position', 'season_type', 'result'}
+compact_quarters = {'start_quarter', 'end_quarter'}
+compact_int16 = {
+    'season_year',
+    'start_time',
+    'end_time',
+    'pos_time',
+    'start_field',
+    'end_field',
+    'yards_gained',
+    'penalty_yards',
+    'passing_plays',
+    'offense_plays',
+    'offense_pts',
+    'defense_ptsa',
+    'offense_score',
+    'defense_score',
+}
+
+
+def compact(df):
+    """Convert a frame to the compact schema above."""
+    index_names = [name for name in df.index.names if name is not None]
+    df = df.reset_index() if index_names else df.copy()
+
+    for col in df:
+        if col in compact_categorical:
+            df[col] = df[col].astype('category')
+        elif col in compact_quarters:
+            df[col] = quarter_codes(df[col])
+        elif pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            df[col] = _compact_numeric(df[col])
+
+    return df.set_index(index_names) if index_names else df
+
+
+def memory_report(before, after):
+    """Bytes used per column (and by the index) before and after ``compact``."""
+    report = pd.DataFrame(dict(
+        before=before.memory_usage(deep=True),
+        after=after.memory_usage(deep=True),
+    ))
+    report.loc['Total'] = report.sum()
+    report['saved'] = report['before'] - report['after']
+    return report
+
+
+def _compact_numeric(series):
+    values = series.dropna()
+    if len(values) and not (values == values.round()).all():
+        return series.astype(np.float32)
+
+    dtype = np.int16 if series.name in compact_int16 or str(series.name).endswith('_yds') else np.int8
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError('Column {} does not fit in {}'.format(series.name, dtype.__name__))
+    if len(values) < len(series):
+        return series.astype(dtype.__name__.capitalize())
+    return series.astype(dtype)
+
+
+def levenshtein(a, b):
+    """Edit distance between two strings, as in Postgres' ``fuzzystrmatch.levenshtein``."""
+    previous = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i]
+        for j, b_char in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a_char != b_char),
+            ))
+        previous = current
+    return previous[-1]
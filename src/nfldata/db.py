@@ -0,0 +1,273 @@
+"""The single path by which ``historical`` and ``lookup`` read from nfldb.
+
+Queries are written for nfldb's Postgres database,
+with psycopg2-style ``%(name)s`` parameters where tuples expand to ``IN`` lists.
+They can also run against a local SQLite or DuckDB snapshot of nfldb (see ``snapshot``):
+for those, parameters are rewritten as named binds, tuples of tuples as ``VALUES`` lists,
+and SQLite gets a Python ``levenshtein`` function when connected through ``connect``::
+
+    nfldb-snapshot postgresql://nfldb@localhost/nfldb sqlite:///nfldb.sqlite --seasons 2012 2016
+
+    engine = db.connect('sqlite:///nfldb.sqlite')
+    games = historical.team_stats_by_game(engine)
+
+"""
+import argparse
+from concurrent.futures import Future
+import re
+import sqlite3
+import time
+import pandas as pd
+
+from nfldata import cache, trace
+from nfldata.common import levenshtein
+
+_table_pattern = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)', re.IGNORECASE)
+_param_pattern = re.compile(r'%\((\w+)\)s')
+
+snapshot_tables = ['game', 'drive', 'play', 'agg_play', 'play_player', 'player']
+snapshot_indexes = [
+    ('game', ['gsis_id']),
+    ('game', ['season_year', 'week', 'season_type']),
+    ('drive', ['gsis_id', 'drive_id']),
+    ('play', ['gsis_id', 'drive_id', 'play_id']),
+    ('agg_play', ['gsis_id', 'drive_id', 'play_id']),
+    ('play_player', ['gsis_id', 'drive_id', 'play_id', 'player_id']),
+    ('play_player', ['player_id']),
+    ('player', ['player_id']),
+    ('player', ['full_name']),
+]
+
+
+def read_sql_query(sql, connection, params=None, **kwargs):
+    start = time.perf_counter()
+    query_cache = cache.active()
+    if query_cache is None:
+        result = _read_sql_query(sql, connection, params, **kwargs)
+    else:
+        result = query_cache.read(
+            connection, sql, params, tables_in(sql),
+            lambda: _read_sql_query(sql, connection, params, **kwargs),
+            **kwargs
+        )
+    trace.record_query(sql, params, result, start)
+    return result
+
+
+def read_sql_query_chunks(sql, connection, params=None, chunksize=100000, **kwargs):
+    """Yield the result of a query in frames of at most ``chunksize`` rows.
+
+    From an engine, rows are read through a server-side cursor (``stream_results``) where the driver has one,
+    as psycopg2 does, so neither the client nor the driver holds more than a chunk at a time.
+    Chunks are recorded by ``trace`` but never cached.
+
+    """
+    if hasattr(connection, 'pool'):
+        # Check out a connection of our own, so the streaming option doesn't apply to other reads.
+        with connection.connect() as streaming:
+            yield from _read_sql_query_chunks(
+                sql, streaming.execution_options(stream_results=True), params, chunksize, kwargs,
+            )
+    else:
+        yield from _read_sql_query_chunks(sql, connection, params, chunksize, kwargs)
+
+
+def read_sql_table(table, connection, **kwargs):
+    start = time.perf_counter()
+    query_cache = cache.active()
+    if query_cache is None:
+        result = pd.read_sql_table(table, connection, **kwargs)
+    else:
+        result = query_cache.read(
+            connection, 'TABLE ' + table, None, {table},
+            lambda: pd.read_sql_table(table, connection, **kwargs),
+            **kwargs
+        )
+    trace.record_query('TABLE ' + table, None, result, start)
+    return result
+
+
+def game_conditions(include_preseason=True, after_gsis_id=None, season_weeks=None,
+                    season_year=None, week=None, season_type=None, team=None):
+    """SQL conditions on nfldb's ``game`` table and their parameters, to push filters below aggregation.
+
+    ``season_year``, ``week``, ``season_type`` and ``team`` are each a value or a collection of values;
+    ``team`` matches games that team played in, home or away.
+    ``season_weeks`` is a pair of inclusive ``(season_year, week)`` bounds.
+
+    """
+    conditions = []
+    params = {}
+    if not include_preseason:
+        conditions.append("season_type != 'Preseason'")
+    if after_gsis_id is not None:
+        conditions.append('gsis_id > %(after_gsis_id)s')
+        params['after_gsis_id'] = after_gsis_id
+    if season_weeks is not None:
+        (params['first_season_year'], params['first_week']), (params['last_season_year'], params['last_week']) = season_weeks
+        conditions.append('(season_year, week) >= (%(first_season_year)s, %(first_week)s)')
+        conditions.append('(season_year, week) <= (%(last_season_year)s, %(last_week)s)')
+    for column, value in [('season_year', season_year), ('week', week), ('season_type', season_type)]:
+        if value is not None:
+            conditions.append('{0} IN %({0})s'.format(column))
+            params[column] = values(value)
+    if team is not None:
+        conditions.append('(home_team IN %(teams)s OR away_team IN %(teams)s)')
+        params['teams'] = values(team)
+    return conditions, params
+
+
+def values(value):
+    """A filter value as a tuple of Python scalars, for an ``IN`` list."""
+    if isinstance(value, str) or not hasattr(value, '__iter__'):
+        value = [value]
+    return tuple(item.item() if hasattr(item, 'item') else item for item in value)
+
+
+def submit(executor, connection, function, /, *args, **kwargs):
+    """Start ``function(*args, **kwargs)``, a read from ``connection``, and return its future.
+
+    It runs on ``executor`` only if ``connection`` is an engine whose pool gives each worker its own connection;
+    otherwise (no executor, a single connection, or an in-memory SQLite pool) it runs now, in this thread.
+
+    """
+    if executor is None or not pooled(connection):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+    return executor.submit(trace.propagate(function), *args, **kwargs)
+
+
+def pooled(connection):
+    """Whether concurrent reads from ``connection`` can each check out their own database connection."""
+    pool = getattr(connection, 'pool', None)
+    return pool is not None and type(pool).__name__ not in {'SingletonThreadPool', 'StaticPool'}
+
+
+def tables_in(sql):
+    return set(_table_pattern.findall(sql))
+
+
+def connect(url, **kwargs):
+    """A SQLAlchemy engine for ``url``, with the functions nfldb queries need registered on SQLite."""
+    from sqlalchemy import create_engine, event
+    engine = create_engine(url, **kwargs)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', lambda dbapi_connection, record: register_functions(dbapi_connection))
+    return engine
+
+
+def register_functions(sqlite_connection):
+    """Add Postgres functions used by nfldb queries to a ``sqlite3`` connection."""
+    sqlite_connection.create_function('levenshtein', 2, levenshtein, deterministic=True)
+
+
+def dialect(connection):
+    """The SQL dialect of a SQLAlchemy engine or connection, or of a DBAPI connection."""
+    sqlalchemy_dialect = getattr(connection, 'dialect', None)
+    if sqlalchemy_dialect is not None:
+        return sqlalchemy_dialect.name
+    if isinstance(connection, sqlite3.Connection):
+        return 'sqlite'
+    return 'postgresql'
+
+
+def translate(sql, params):
+    """``sql`` and ``params`` with psycopg2's pyformat parameters rewritten as ``:name`` binds.
+
+    A tuple parameter becomes a parenthesized list of binds, as psycopg2 adapts it,
+    and a tuple of tuples becomes a ``VALUES`` list for row-value ``IN`` comparisons.
+
+    """
+    named = {}
+
+    def bind(name, value):
+        named[name] = value
+        return ':' + name
+
+    def replace(match):
+        name = match.group(1)
+        value = params[name]
+        if not isinstance(value, (tuple, list)):
+            return bind(name, value)
+        if not value:
+            return '(NULL)'
+        if isinstance(value[0], (tuple, list)):
+            return '(VALUES {})'.format(', '.join(
+                '({})'.format(', '.join(bind('{}_{}_{}'.format(name, i, j), item) for j, item in enumerate(row)))
+                for i, row in enumerate(value)
+            ))
+        return '({})'.format(', '.join(bind('{}_{}'.format(name, i), item) for i, item in enumerate(value)))
+
+    return _param_pattern.sub(replace, sql), named
+
+
+def snapshot(source, target, season_years=None, tables=snapshot_tables, chunksize=100000):
+    """Copy nfldb's ``tables`` from ``source`` into ``target`` (engines or URLs), replacing them.
+
+    With ``season_years``, an inclusive ``(first, last)`` pair,
+    only those seasons' games (and their drives, plays and stats) are copied; all players are.
+    Returns the target engine.
+
+    """
+    source = connect(source) if isinstance(source, str) else source
+    target = connect(target) if isinstance(target, str) else target
+    for table in tables:
+        sql = 'SELECT * FROM {}'.format(table)
+        params = None
+        if season_years is not None and table != 'player':
+            sql += ' WHERE gsis_id IN (SELECT gsis_id FROM game WHERE season_year BETWEEN %(first)s AND %(last)s)'
+            params = dict(first=season_years[0], last=season_years[1])
+        with target.begin() as connection:
+            if_exists = 'replace'
+            for chunk in _read_sql_query(sql, source, params, chunksize=chunksize):
+                chunk.to_sql(table, connection, if_exists=if_exists, index=False)
+                if_exists = 'append'
+    create_indexes(target, tables)
+    return target
+
+
+def create_indexes(engine, tables=snapshot_tables):
+    """Create nfldb's key indexes on a snapshot."""
+    from sqlalchemy import text
+    with engine.begin() as connection:
+        for table, columns in snapshot_indexes:
+            if table in tables:
+                connection.execute(text('CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({2})'.format(
+                    table, '_'.join(columns), ', '.join(columns),
+                )))
+
+
+def _read_sql_query(sql, connection, params=None, **kwargs):
+    if params is None or dialect(connection) == 'postgresql':
+        return pd.read_sql_query(sql, connection, params=params, **kwargs)
+    sql, params = translate(sql, params)
+    if hasattr(connection, 'dialect'):
+        from sqlalchemy import text
+        sql = text(sql)
+    return pd.read_sql_query(sql, connection, params=params, **kwargs)
+
+
+def _read_sql_query_chunks(sql, connection, params, chunksize, kwargs):
+    start = time.perf_counter()
+    for chunk in _read_sql_query(sql, connection, params, chunksize=chunksize, **kwargs):
+        trace.record_query(sql, params, chunk, start)
+        yield chunk
+        start = time.perf_counter()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Snapshot nfldb into a local database.')
+    parser.add_argument('source', help='SQLAlchemy URL of nfldb')
+    parser.add_argument('target', help='SQLAlchemy URL of the snapshot, e.g. sqlite:///nfldb.sqlite')
+    parser.add_argument('--seasons', nargs=2, type=int, metavar=('FIRST', 'LAST'))
+    parser.add_argument('--tables', nargs='+', default=snapshot_tables)
+    args = parser.parse_args(args)
+    snapshot(args.source, args.target, args.seasons, args.tables)
+
+
+if __name__ == '__main__':
+    main()
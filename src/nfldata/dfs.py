@@ -0,0 +1,342 @@
+"""Daily fantasy lineup optimization for the sites in ``data/dfs_sites.yaml``.
+
+Lineups are found by an exact branch-and-bound search.
+Players of each position are tried in order of projected points,
+and a branch is cut as soon as an upper bound on its best completion
+cannot beat the worst of the lineups kept so far.
+The bound is exact apart from constraints and distinctness across positions:
+a table, per position and remaining salary, of the most points obtainable
+from the players not yet considered plus every later position,
+built once per roster configuration by knapsack-style dynamic programming.
+
+"""
+from collections import Counter
+from itertools import count, product
+from math import gcd
+import heapq
+import os
+from toolz import memoize
+import numpy as np
+import pandas as pd
+
+from nfldata import names, projected, reference
+
+# The bound tables have one cell per salary unit;
+# coarser units make them smaller at the cost of a slightly looser bound.
+max_salary_cells = 1000
+
+
+@memoize
+def get_sites():
+    return reference.load('dfs_sites')
+
+
+def get_site(site):
+    return get_sites()[site.lower()]
+
+
+def join_salaries(projections, salaries, site='draftkings', column='dfs_salary'):
+    """``projections`` (as from ``projected.load_by_week``) with a ``column`` of salaries from a site's salary file.
+
+    ``salaries`` is the file as read, e.g. by ``pd.read_csv``;
+    its columns are renamed as projections' are (so ``Salary`` becomes ``dfs_salary``).
+    Names, positions and teams on both sides are normalized for ``site`` (see ``names.Normalizer``),
+    which raises one ``ValueError`` listing every unknown team,
+    and then joined in a single merge. Players missing from the file get no salary.
+
+    """
+    normalizer = names.Normalizer(site)
+    keys = ['name', 'pos', 'team']
+    salaries = salaries.rename(columns=lambda col: projected.get_column_renames().get(
+        projected.standardize_str(col), projected.standardize_str(col),
+    ))
+    joined = normalizer.normalize(projections[keys]).merge(
+        normalizer.normalize(salaries[keys + ['dfs_salary']]).rename(columns=dict(dfs_salary=column)),
+        on=keys, how='left', validate='many_to_one',
+    )
+    return projections.assign(**{column: joined[column].values})
+
+
+def optimize(projections, salaries=None, site='draftkings', n_lineups=1, points='projected_fp',
+             max_exposure=None, stacks=(), max_per_team=None, executor=None, n_tasks=None):
+    """The ``n_lineups`` highest-scoring distinct lineups for a site.
+
+    ``projections`` is a frame from ``projected.sanitize`` (indexed by ``gsis_id``, ``player_id``,
+    with ``pos`` and ``team`` columns) and ``salaries`` a Series aligned with it,
+    or the name of a salary column (default ``dfs_salary``).
+    Players without a salary or projection are left out.
+
+    ``max_exposure`` caps the share of lineups any player appears in,
+    either as one fraction or as a mapping from index to fraction.
+    A player may appear in ``int(fraction * n_lineups)`` lineups, so a fraction below ``1 / n_lineups`` leaves them out.
+    Lineups are then the best ones in order, skipping any that would exceed a cap.
+    Each time players reach their caps the search runs again without them,
+    so tight caps cost roughly one search per pass.
+    ``stacks`` is a sequence of ``(anchor_pos, positions, count)``:
+    every anchor needs at least ``count`` lineup-mates of those positions on its team,
+    e.g. ``[('QB', ('WR', 'TE'), 1)]``.
+    ``max_per_team`` limits players from one team.
+
+    With an ``executor`` (e.g. a ``ProcessPoolExecutor``) the search is split into ``n_tasks`` parts.
+
+    Returns a frame indexed by (``lineup``, ``gsis_id``, ``player_id``), best lineup first,
+    with each player's roster ``slot``, ``pos``, ``team``, ``salary`` and ``points``.
+
+    """
+    config = get_site(site)
+    if salaries is None:
+        salaries = 'dfs_salary'
+    if isinstance(salaries, str):
+        salaries = projections[salaries]
+
+    players = pd.DataFrame(dict(
+        pos=projections['pos'],
+        team=projections['team'],
+        salary=salaries.reindex(projections.index),
+        points=projections[points],
+    ))
+    players = players[players['salary'].notnull() & players['points'].notnull()]
+    players = players[players['pos'].isin(_positions(config['roster_slots']))]
+    players['salary'] = players['salary'].astype(int)
+    players = players.sort_values('points', ascending=False, kind='mergesort')
+
+    caps = _exposure_caps(players.index, max_exposure, n_lineups)
+    # Plain object arrays, since the constraints index them one player at a time.
+    constraints = _Constraints(players['pos'].to_numpy(dtype=object), players['team'].to_numpy(dtype=object),
+                               stacks, max_per_team)
+
+    # Lineups are accepted best first, skipping those with a player at their cap.
+    # A lineup skipped once always would be, so each pass searches again without the capped players
+    # or the accepted lineups, and the lineups it finds rank below everything already considered.
+    accepted = []
+    accepted_sets = set()
+    counts = Counter()
+    while True:
+        excluded = np.array([counts[i] >= caps[i] for i in range(len(players))], dtype=bool)
+        searches = [
+            _Search(players, counts, config['salary_cap'], constraints, excluded, accepted_sets)
+            for counts in _position_counts(config['roster_slots'])
+        ]
+        n_needed = n_lineups - len(accepted)
+        candidates = _top_lineups(searches, n_needed, executor, n_tasks)
+        for _, lineup in candidates:
+            if any(counts[i] >= caps[i] for i in lineup):
+                continue
+            accepted.append(lineup)
+            accepted_sets.add(lineup)
+            counts.update(lineup)
+            if len(accepted) == n_lineups:
+                break
+        if len(accepted) == n_lineups or len(candidates) < n_needed:
+            break
+
+    return _lineup_frame(players, config['roster_slots'], accepted)
+
+
+class _Constraints:
+    def __init__(self, positions, teams, stacks, max_per_team):
+        self.positions = positions
+        self.teams = teams
+        self.stacks = [(anchor, set(stack_positions), min_count) for anchor, stack_positions, min_count in stacks]
+        self.max_per_team = max_per_team
+
+    def __call__(self, lineup, done=None):
+        """Whether ``lineup`` satisfies the constraints, or for a partial lineup, still could.
+
+        ``done`` is the set of positions already complete, by default all of them.
+
+        """
+        if self.max_per_team is not None and lineup:
+            if max(Counter(self.teams[i] for i in lineup).values()) > self.max_per_team:
+                return False
+        for anchor, stack_positions, min_count in self.stacks:
+            if done is not None and not stack_positions <= done:
+                continue
+            for i in lineup:
+                if self.positions[i] == anchor and sum(
+                    1 for j in lineup
+                    if j != i and self.teams[j] == self.teams[i] and self.positions[j] in stack_positions
+                ) < min_count:
+                    return False
+        return True
+
+
+def _top_lineups(searches, n_lineups, executor=None, n_tasks=None):
+    """The best ``n_lineups`` lineups over all searches, as (points, player rows) pairs."""
+    if executor is None:
+        results = [search.run(n_lineups) for search in searches]
+    else:
+        n_tasks = n_tasks or 4 * os.cpu_count()
+        results = [
+            future.result() for future in [
+                executor.submit(_run_search, search, n_lineups, firsts)
+                for search in searches
+                for firsts in np.array_split(np.arange(search.n_first), max(1, n_tasks // len(searches)))
+                if len(firsts)
+            ]
+        ]
+    return heapq.nlargest(n_lineups, (lineup for result in results for lineup in result))
+
+
+def _run_search(search, n_lineups, firsts):
+    return search.run(n_lineups, firsts)
+
+
+class _Search:
+    """Branch and bound over one roster configuration, i.e. a number of players per position."""
+
+    def __init__(self, players, counts, salary_cap, constraints, excluded, skipped=frozenset()):
+        self.salary_cap = salary_cap
+        self.constraints = constraints
+        self.skipped = skipped
+
+        unit = gcd(salary_cap, int(np.gcd.reduce(players['salary'].values))) if len(players) else salary_cap
+        unit = max(unit, -(-salary_cap // max_salary_cells))
+        self.unit = unit
+        n_cells = salary_cap // unit + 1
+
+        # Stack anchors and then their stacked positions go first, so unmet stacks are cut early.
+        stacked = [pos for anchor, stack_positions, _ in constraints.stacks for pos in [anchor] + sorted(stack_positions)]
+        counts = sorted(counts, key=lambda item: stacked.index(item[0]) if item[0] in stacked else len(stacked))
+
+        self.groups = []
+        for pos, n_players in counts:
+            is_pos = (players['pos'].values == pos) & ~excluded
+            self.groups.append(dict(
+                pos=pos,
+                count=n_players,
+                rows=np.flatnonzero(is_pos),
+                points=players['points'].values[is_pos].astype(float),
+                salary=players['salary'].values[is_pos],
+            ))
+
+        # Most points from all later groups, by salary cell.
+        rest = np.zeros(n_cells)
+        for group in reversed(self.groups):
+            group['bound'] = _bound_table(group['points'], group['salary'] // unit, group['count'], rest)
+            rest = group['bound'][0, group['count']]
+
+    @property
+    def n_first(self):
+        return len(self.groups[0]['rows']) if self.groups else 0
+
+    def run(self, n_lineups, firsts=None):
+        self._heap = []
+        self._n_lineups = n_lineups
+        self._ties = count()
+        self._chosen = []
+        if self.groups:
+            self._extend(0, 0, self.groups[0]['count'], self.salary_cap, 0.0, firsts)
+        return [(points, lineup) for points, _, lineup in self._heap]
+
+    def _threshold(self):
+        return self._heap[0][0] if len(self._heap) == self._n_lineups else -np.inf
+
+    def _extend(self, g, start, remaining, salary_left, points, candidates=None):
+        if not remaining:
+            if g + 1 < len(self.groups):
+                if not self.constraints(self._chosen, {group['pos'] for group in self.groups[:g + 1]}):
+                    return
+                self._extend(g + 1, 0, self.groups[g + 1]['count'], salary_left, points)
+            elif self.constraints(self._chosen):
+                entry = points, next(self._ties), tuple(sorted(self._chosen))
+                if entry[2] in self.skipped:
+                    return
+                if len(self._heap) < self._n_lineups:
+                    heapq.heappush(self._heap, entry)
+                else:
+                    heapq.heapreplace(self._heap, entry)
+            return
+
+        group = self.groups[g]
+        last = len(group['rows']) - remaining
+        if candidates is None:
+            candidates = np.arange(start, last + 1)
+        candidates = candidates[(candidates <= last) & (group['salary'][candidates] <= salary_left)]
+        salary_after = salary_left - group['salary'][candidates]
+        # The most any lineup through each candidate could score.
+        bounds = (points + group['points'][candidates]
+                  + group['bound'][candidates + 1, remaining - 1, salary_after // self.unit])
+        keep = bounds > self._threshold()
+
+        for i, left, bound in zip(candidates[keep], salary_after[keep], bounds[keep]):
+            if bound <= self._threshold():
+                continue
+            self._chosen.append(group['rows'][i])
+            self._extend(g, i + 1, remaining - 1, left, points + group['points'][i])
+            self._chosen.pop()
+
+
+def _bound_table(points, salary_cells, count, rest):
+    """``table[i, j, s]``: most points from ``j`` of players ``i:`` plus ``rest``, costing at most ``s`` cells.
+
+    Seeding the knapsack recursion with ``rest`` (the best of the later groups by salary)
+    gives the same result as combining the two tables afterwards, without the quadratic max-plus convolution.
+
+    """
+    n_cells = len(rest)
+    table = np.full((len(points) + 1, count + 1, n_cells), -np.inf)
+    table[:, 0, :] = rest
+    for i in range(len(points) - 1, -1, -1):
+        table[i] = table[i + 1]
+        cells = salary_cells[i]
+        if cells < n_cells:
+            np.maximum(table[i, 1:, cells:], points[i] + table[i + 1, :-1, :n_cells - cells], out=table[i, 1:, cells:])
+    return table
+
+
+def _positions(roster_slots):
+    return {pos for slot in roster_slots for pos in ([slot] if isinstance(slot, str) else slot)}
+
+
+def _position_counts(roster_slots):
+    """Every distinct number of players per position that fills the roster."""
+    fixed = [slot for slot in roster_slots if isinstance(slot, str)]
+    flex = [slot for slot in roster_slots if not isinstance(slot, str)]
+    order = list(dict.fromkeys(fixed + [pos for slot in flex for pos in slot]))
+    configs = {
+        tuple(sorted(Counter(fixed + list(flex_positions)).items(), key=lambda item: order.index(item[0])))
+        for flex_positions in product(*flex)
+    }
+    return sorted(configs)
+
+
+def _exposure_caps(index, max_exposure, n_lineups):
+    if max_exposure is None:
+        return [n_lineups] * len(index)
+    if isinstance(max_exposure, dict):
+        fractions = [max_exposure.get(key, 1) for key in index]
+    else:
+        fractions = [max_exposure] * len(index)
+    return [int(fraction * n_lineups) for fraction in fractions]
+
+
+def _lineup_frame(players, roster_slots, lineups):
+    slot_names = ['/'.join(slot) if not isinstance(slot, str) else slot for slot in roster_slots]
+    frames = []
+    for number, lineup in enumerate(lineups):
+        lineup_players = players.iloc[list(lineup)]
+        slots = _assign_slots(lineup_players['pos'].tolist(), roster_slots)
+        frames.append(
+            lineup_players
+            .assign(lineup=number, slot=[slot_names[slot] for slot in slots])
+            .iloc[np.argsort(slots)]
+        )
+    if not frames:
+        return pd.DataFrame(columns=['slot', 'pos', 'team', 'salary', 'points'])
+    return (pd.concat(frames)
+            .reset_index()
+            .set_index(['lineup', 'gsis_id', 'player_id'])
+            [['slot', 'pos', 'team', 'salary', 'points']]
+            )
+
+
+def _assign_slots(positions, roster_slots):
+    """Each player's roster slot, filling fixed slots before flex slots."""
+    slots = [None] * len(positions)
+    open_slots = sorted(range(len(roster_slots)), key=lambda s: not isinstance(roster_slots[s], str))
+    for s in open_slots:
+        allowed = [roster_slots[s]] if isinstance(roster_slots[s], str) else roster_slots[s]
+        player = next(p for p, pos in enumerate(positions) if slots[p] is None and pos in allowed)
+        slots[player] = s
+    return slots
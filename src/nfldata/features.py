@@ -0,0 +1,326 @@
+"""Rolling features of players and teams over historical game frames.
+
+``RollingFeatures`` computes, for every row of a ``historical`` per-game frame, what was known before that game:
+the mean of the last ``n`` games, the season-to-date sum and an exponentially weighted mean per halflife.
+Rows are sorted once by entity and game, and every window is read from cumulative sums over those
+entity-contiguous arrays, so there is no per-group Python.
+The state each window needs is kept per entity, so a new week is appended in time proportional to its rows::
+
+    features = RollingFeatures(['receiving_yds', 'receiving_tar'], last_n=[3, 5], halflives=[4])
+    history = features.update(historical.player_stats_by_game(connection, season_year=[2014, 2015]), season_year)
+    features.update(historical.player_stats_by_game(connection, season_year=2016, week=1), season_year)
+    week_2 = features.before(projected.sanitize(connection, projections))
+
+Here ``season_year`` maps ``gsis_id`` to season, e.g. a column of ``historical.team_stats_by_game``.
+``OpponentAdjusted`` builds the same windows over what each defense allowed,
+relative to what its opponents usually produce.
+
+"""
+import pickle
+import numpy as np
+import pandas as pd
+
+# Decayed sums are computed in blocks over which the weights span at most this many orders of magnitude,
+# so that sums across entities with very different histories keep their precision.
+_max_decay_orders = 3
+
+
+class RollingFeatures:
+    def __init__(self, columns, by='player_id', last_n=(3,), halflives=(4,), season_to_date=True):
+        """Windows over ``columns``, per ``by`` (an index level or column of the frames given to ``update``)."""
+        self.columns = list(columns)
+        self.by = by
+        self.last_n = sorted(last_n)
+        self.halflives = list(halflives)
+        self.season_to_date = season_to_date
+
+        n_columns = len(self.columns)
+        self.tail_length = max(self.last_n, default=0)
+        self._keys = pd.Index([])
+        self._last_gsis_id = np.array([], dtype=object)
+        self._count = np.zeros(0, dtype=np.int64)
+        self._season = np.zeros(0, dtype=np.int64)
+        self._season_count = np.zeros(0, dtype=np.int64)
+        self._season_sums = np.zeros((0, n_columns))
+        self._tail = np.zeros((0, self.tail_length, n_columns))
+        self._tail_count = np.zeros(0, dtype=np.int64)
+        self._decayed = np.zeros((0, len(self.halflives), n_columns))
+        self._weights = np.zeros((0, len(self.halflives)))
+
+    @property
+    def feature_columns(self):
+        return (['games']
+                + ['{}_last{}'.format(column, n) for n in self.last_n for column in self.columns]
+                + (['season_games'] + ['{}_season'.format(column) for column in self.columns]
+                   if self.season_to_date else [])
+                + ['{}_ewm{}'.format(column, halflife) for halflife in self.halflives for column in self.columns])
+
+    def update(self, stats, season_year=None):
+        """Pre-game features of every row of ``stats``, aligned to its index; the rows are then added to the state.
+
+        ``season_year`` is a column of ``stats`` (by default ``'season_year'``)
+        or a Series mapping ``gsis_id`` to season.
+        Every row must come after the last game already added for its entity.
+
+        """
+        keys = _values(stats, self.by)
+        gsis_ids = np.asarray(_values(stats, 'gsis_id'), dtype=object)
+        seasons = self._seasons(stats, season_year)
+        values = np.nan_to_num(stats[self.columns].to_numpy(dtype=np.float64))
+
+        order = np.lexsort([gsis_ids, keys])
+        keys, gsis_ids, seasons, values = keys[order], gsis_ids[order], seasons[order], values[order]
+        entities = self._entities(keys)
+        if (gsis_ids <= self._last_gsis_id[entities]).any():
+            raise ValueError('Rows must come after the games already added for each {}'.format(self.by))
+
+        n_rows = len(keys)
+        first = np.ones(n_rows, dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        segment = np.cumsum(first) - 1
+        segment_start = np.flatnonzero(first)
+        local = np.arange(n_rows) - segment_start[segment]
+        last = np.append(segment_start[1:] - 1, n_rows - 1) if n_rows else segment_start
+        segment_entities = entities[segment_start]
+
+        features = {'games': self._count[entities] + local}
+        tail, tail_valid = self._extend_tails(values, segment, segment_start, segment_entities)
+        for n in self.last_n:
+            features.update(_named(self.columns, '_last{}'.format(n), _window_means(
+                tail, tail_valid, np.arange(n_rows) + self.tail_length * (segment + 1), n,
+            )))
+
+        season_start = first.copy()
+        season_start[1:] |= seasons[1:] != seasons[:-1]
+        season_first = np.maximum.accumulate(np.where(season_start, np.arange(n_rows), 0))
+        carried = (season_first == segment_start[segment]) & (seasons == self._season[entities])
+        sums_before = _exclusive_cumsum(values)
+        season_sums = sums_before - sums_before[season_first] + np.where(
+            carried[:, None], self._season_sums[entities], 0,
+        )
+        season_count = np.arange(n_rows) - season_first + np.where(carried, self._season_count[entities], 0)
+        if self.season_to_date:
+            features['season_games'] = season_count
+            features.update(_named(self.columns, '_season', season_sums))
+
+        decayed_before = []
+        for h, halflife in enumerate(self.halflives):
+            decay = 0.5 ** (1 / halflife)
+            sums = _decayed_sums(values, local, segment, decay, self._decayed[segment_entities, h])
+            weights = _decayed_sums(
+                np.ones((n_rows, 1)), local, segment, decay, self._weights[segment_entities, h][:, None],
+            )[:, 0]
+            decayed_before.append((sums, weights))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features.update(_named(self.columns, '_ewm{}'.format(halflife), sums / weights[:, None]))
+
+        # The state after each entity's last row, which is the state before a row that would follow it.
+        ends = last
+        self._last_gsis_id[segment_entities] = gsis_ids[ends]
+        self._count[segment_entities] = features['games'][ends] + 1
+        self._season[segment_entities] = seasons[ends]
+        self._season_count[segment_entities] = season_count[ends] + 1
+        self._season_sums[segment_entities] = season_sums[ends] + values[ends]
+        if self.tail_length:
+            tail_end = ends + self.tail_length * (segment[ends] + 1) + 1
+            positions = tail_end[:, None] - np.arange(self.tail_length, 0, -1)
+            self._tail[segment_entities] = tail[positions]
+            self._tail_count[segment_entities] = tail_valid[positions].sum(axis=1)
+        for h, halflife in enumerate(self.halflives):
+            decay = 0.5 ** (1 / halflife)
+            sums, weights = decayed_before[h]
+            self._decayed[segment_entities, h] = decay * sums[ends] + values[ends]
+            self._weights[segment_entities, h] = decay * weights[ends] + 1
+
+        unsorted = np.empty_like(order)
+        unsorted[order] = np.arange(n_rows)
+        return pd.DataFrame({name: features[name][unsorted] for name in self.feature_columns}, index=stats.index)
+
+    def before(self, frame, season_year=None, by=None):
+        """Features of the entities in ``frame`` given every game added so far, aligned to its index.
+
+        Meant for the upcoming games in a frame from ``projected.sanitize``.
+        Season-to-date windows restart if ``season_year`` (a column of ``frame``, by default ``'season_year'``
+        if present, or a single season) differs from an entity's last season.
+        Entities with no games yet get missing values; ``by`` overrides ``self.by`` for ``frame``.
+
+        """
+        keys = _values(frame, self.by if by is None else by)
+        entities = self._keys.get_indexer(keys)
+        known = entities >= 0
+        entities = np.where(known, entities, 0)
+
+        def masked(array):
+            array = np.asarray(array, dtype=np.float64)
+            return np.where(known.reshape((-1,) + (1,) * (array.ndim - 1)), array, np.nan)
+
+        if not len(self._keys):
+            return pd.DataFrame(np.nan, index=frame.index, columns=self.feature_columns)
+        features = {'games': np.where(known, self._count[entities], 0)}
+        for n in self.last_n:
+            window = self._tail[entities][:, -n:]
+            counts = np.minimum(self._tail_count[entities], n)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features.update(_named(self.columns, '_last{}'.format(n), masked(window.sum(axis=1) / counts[:, None])))
+        if self.season_to_date:
+            if season_year is None and 'season_year' in frame:
+                season_year = 'season_year'
+            same_season = np.ones(len(keys), dtype=bool)
+            if season_year is not None:
+                seasons = frame[season_year].values if isinstance(season_year, str) else season_year
+                same_season = np.asarray(seasons) == self._season[entities]
+            features['season_games'] = np.where(known & same_season, self._season_count[entities], 0)
+            features.update(_named(self.columns, '_season', np.where(
+                (known & same_season)[:, None], self._season_sums[entities], 0,
+            )))
+        for h, halflife in enumerate(self.halflives):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                features.update(_named(self.columns, '_ewm{}'.format(halflife), masked(
+                    self._decayed[entities, h] / self._weights[entities, h][:, None]
+                )))
+        return pd.DataFrame({name: features[name] for name in self.feature_columns}, index=frame.index)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _seasons(self, stats, season_year):
+        if season_year is None or isinstance(season_year, str):
+            return np.asarray(stats[season_year or 'season_year'], dtype=np.int64)
+        return np.asarray(season_year.reindex(_values(stats, 'gsis_id')), dtype=np.int64)
+
+    def _entities(self, keys):
+        """State positions of ``keys``, adding zeroed state for new ones."""
+        new = pd.Index(keys).unique().difference(self._keys)
+        if len(new):
+            n_new = len(new)
+            self._keys = self._keys.append(new)
+            self._last_gsis_id = np.append(self._last_gsis_id, np.full(n_new, '', dtype=object))
+            for name in ['_count', '_season', '_season_count', '_tail_count']:
+                setattr(self, name, np.append(getattr(self, name), np.zeros(n_new, dtype=np.int64)))
+            for name in ['_season_sums', '_tail', '_decayed', '_weights']:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros((n_new,) + array.shape[1:])]))
+        return self._keys.get_indexer(keys)
+
+    def _extend_tails(self, values, segment, segment_start, segment_entities):
+        """``values`` with each entity's saved last games in front of its rows, and which of those rows are real."""
+        n_segments, n_columns = len(segment_start), values.shape[1]
+        length = self.tail_length
+        extended = np.zeros((len(values) + length * n_segments, n_columns))
+        valid = np.zeros(len(extended), dtype=bool)
+        rows = np.arange(len(values)) + length * (segment + 1)
+        extended[rows] = values
+        valid[rows] = True
+        if length:
+            tail_rows = (segment_start + length * np.arange(n_segments))[:, None] + np.arange(length)
+            extended[tail_rows] = self._tail[segment_entities]
+            valid[tail_rows] = np.arange(length) >= length - self._tail_count[segment_entities][:, None]
+        return extended, valid
+
+
+class OpponentAdjusted:
+    def __init__(self, columns, halflives=(4,), last_n=(), season_to_date=False):
+        """Windows over how much more of ``columns`` each team allowed than its opponents usually produce.
+
+        Frames given to ``update`` are from ``historical.team_stats_by_game``, one row per team per game.
+        An offense's expectation before each game is its own exponentially weighted mean
+        with the first of ``halflives``; its first game counts as exactly what was expected.
+
+        """
+        self.columns = list(columns)
+        self.offense = RollingFeatures(self.columns, by='team', last_n=(), halflives=halflives[:1],
+                                       season_to_date=False)
+        self.allowed = RollingFeatures(['{}_over_expected'.format(column) for column in self.columns], by='team',
+                                       last_n=last_n, halflives=halflives, season_to_date=season_to_date)
+
+    @property
+    def feature_columns(self):
+        return self.allowed.feature_columns
+
+    def update(self, team_stats, season_year=None):
+        """Pre-game features of the defense in every row of ``team_stats``, which has that row's offensive stats."""
+        expected = self.offense.update(team_stats, season_year)[
+            ['{}_ewm{}'.format(column, self.offense.halflives[0]) for column in self.columns]
+        ]
+        # An offense's first game carries no information about the defense.
+        excess = np.nan_to_num(team_stats[self.columns].to_numpy(dtype=np.float64) - expected.to_numpy())
+        allowed = pd.DataFrame(excess, index=team_stats.index, columns=self.allowed.columns)
+        allowed['team'] = opponents(team_stats)
+        allowed['gsis_id'] = _values(team_stats, 'gsis_id')
+        if season_year is None or isinstance(season_year, str):
+            allowed['season_year'] = team_stats[season_year or 'season_year'].values
+            season_year = 'season_year'
+        return self.allowed.update(allowed, season_year)
+
+    def before(self, frame, season_year=None, by='opp'):
+        """Features of the opposing defense (column ``by``) of every row of ``frame``."""
+        return self.allowed.before(frame, season_year, by)
+
+
+def opponents(team_stats):
+    """Each row's opponent in a frame from ``historical.team_stats_by_game``."""
+    gsis_ids = _values(team_stats, 'gsis_id')
+    teams = pd.Series(team_stats['team'].values)
+    by_game = pd.DataFrame(dict(gsis_id=gsis_ids, team=teams)).groupby('gsis_id')['team']
+    return (by_game.transform('first').where(lambda first: first != teams, by_game.transform('last'))).values
+
+
+def _values(frame, name):
+    if name in frame.index.names:
+        return np.asarray(frame.index.get_level_values(name))
+    return np.asarray(frame[name])
+
+
+def _named(columns, suffix, array):
+    return {column + suffix: array[:, i] for i, column in enumerate(columns)}
+
+
+def _exclusive_cumsum(values):
+    sums = np.cumsum(values, axis=0)
+    return np.concatenate([np.zeros((1,) + values.shape[1:]), sums[:-1]]) if len(values) else sums
+
+
+def _window_means(extended, valid, positions, n):
+    """Means of the valid rows among the ``n`` before each of ``positions`` in ``extended``."""
+    sums = np.concatenate([np.zeros((1, extended.shape[1])), np.cumsum(extended * valid[:, None], axis=0)])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[positions] - sums[positions - n]) / (counts[positions] - counts[positions - n])[:, None]
+
+
+def _decayed_sums(values, local, segment, decay, initial):
+    """Decayed sums of the rows before each row within its segment, starting from ``initial`` per segment.
+
+    That is ``s[0] = initial`` and ``s[j] = decay * s[j - 1] + values[j - 1]`` down each segment,
+    computed in closed form over blocks of rows short enough that ``decay ** -block`` stays small.
+
+    """
+    block = max(1, int(_max_decay_orders / max(-np.log10(decay), 1e-12)))
+    sums = np.empty_like(values)
+    carried = np.asarray(initial, dtype=np.float64)
+    for start in range(0, int(local.max()) + 1 if len(local) else 0, block):
+        rows = np.flatnonzero((local >= start) & (local < start + block))
+        offset = (local[rows] - start).astype(np.float64)
+        scaled = values[rows] * decay ** -offset[:, None]
+        before = _exclusive_cumsum_by(scaled, segment[rows])
+        sums[rows] = decay ** offset[:, None] * (carried[segment[rows]] + before / decay)
+        # Carry each segment's sum past the last row of this block, for the next one.
+        last = np.flatnonzero(np.append(segment[rows][1:] != segment[rows][:-1], True))
+        carried = carried.copy()
+        carried[segment[rows][last]] = decay * sums[rows][last] + values[rows][last]
+    return sums
+
+
+def _exclusive_cumsum_by(values, groups):
+    """Exclusive cumulative sums of ``values`` restarting wherever the (sorted) ``groups`` change."""
+    sums = _exclusive_cumsum(values)
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(groups)), 0))
+    return sums - sums[starts]
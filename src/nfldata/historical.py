@@ -1,9 +1,16 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
 from toolz import curry
 import numpy as np
 import pandas as pd
 
-from nfldata.common import process_time_col
-from nfldata.lookup import score_before_time
+from nfldata import cache, db, scoring, trace
+from nfldata.common import process_time_col, game_clock, compact as compact_frame
+from nfldata.lookup import offense_pts_by_stat, score_before_time, score_timeline, scores_before
+
+# Engines opened by ``concat_partitions`` workers, by (process id, URL).
+_worker_engines = {}
+_game_filters = ['include_preseason', 'after_gsis_id', 'season_weeks', 'season_year', 'week', 'season_type', 'team']
 
 offense_team_stat_columns = [
     'rushing_att',
@@ -42,7 +49,16 @@ special_team_stat_columns = [
 ]
 
 
-def player_stats_by_game(connection, include_preseason=False):
+def player_stats_by_game(connection, include_preseason=False, after_gsis_id=None, season_weeks=None, compact=False,
+                         executor=None, chunksize=None, **filters):
+    """Box-score sums for every offensive player in every game.
+
+    ``filters`` (``season_year``, ``week``, ``season_type`` and ``team``; see ``db.game_conditions``)
+    are applied in SQL, before aggregation; ``team`` keeps only that team's players.
+    With ``chunksize``, returns an iterator of frames of at most that many rows, in order,
+    streamed from the database (see ``db.read_sql_query_chunks``).
+
+    """
     sum_columns = [
         'fumbles_lost',
         'kicking_fga',
@@ -78,6 +94,8 @@ def player_stats_by_game(connection, include_preseason=False):
         'WR',
         'UNK',
     ]
+    game_conditions, game_params = db.game_conditions(include_preseason, after_gsis_id, season_weeks, **filters)
+    team_conditions = ['play_player.team IN %(teams)s'] if filters.get('team') is not None else []
     query = """
       SELECT player_id, position, play_player.team, gsis_id, {}
       FROM play_player
@@ -86,78 +104,165 @@ def player_stats_by_game(connection, include_preseason=False):
       WHERE position IN %(positions)s
       {}
       GROUP BY player_id, position, play_player.team, gsis_id
+      {}
     """.format(
         ', '.join(_sum_query(col) for col in sum_columns),
-        '' if include_preseason else 'INNER JOIN game USING(gsis_id)',
-        '' if include_preseason else "AND season_type != 'Preseason'",
+        'INNER JOIN game USING(gsis_id)' if game_conditions else '',
+        ' '.join('AND ' + condition for condition in game_conditions + team_conditions),
+        '' if chunksize is None else 'ORDER BY gsis_id, player_id',
     )
-    return pd.read_sql_query(
+    params = dict(positions=tuple(positions), **game_params)
+    if chunksize is not None:
+        return _processed_chunks(
+            db.read_sql_query_chunks(query, connection, params, chunksize, index_col=['gsis_id', 'player_id']),
+            compact,
+        )
+    player_stats = db.submit(
+        executor, connection, db.read_sql_query,
         query, connection,
-        params=dict(positions=tuple(positions)),
+        params=params,
         index_col=['gsis_id', 'player_id'],
-    ).sort_index()
+    ).result().sort_index()
+    return compact_frame(player_stats) if compact else player_stats
+
+
+def update_player_stats_by_game(connection, previous, season_weeks=None, **kwargs):
+    """Add new games to a frame from ``player_stats_by_game``.
+
+    ``previous`` is either a frame or the path of a pickled one,
+    which is created or overwritten with the result.
+    By default only games after the last one in ``previous`` are queried;
+    with ``season_weeks``, a pair of inclusive ``(season_year, week)`` bounds,
+    those weeks are queried instead and replace any rows ``previous`` has for them.
+
+    """
+    return _update_by_game(player_stats_by_game, connection, previous, season_weeks, kwargs)
+
+
+def team_stats_by_drive(connection, include_preseason=False, vectorized=True, compact=False, season_weeks=None,
+                        executor=None, **filters):
+    """Offensive stats, field position, clock and score at the start of every drive.
 
+    With an ``executor`` and an engine, the independent queries run concurrently (see ``db.submit``)
+    and drives are parsed while the rest are still loading.
+    ``filters`` are applied in SQL as in ``player_stats_by_game``; ``team`` keeps only that team's drives.
+
+    """
+    game_conditions, game_params = db.game_conditions(include_preseason, season_weeks=season_weeks, **filters)
+    game_join = 'INNER JOIN game USING(gsis_id)' if game_conditions else ''
+    game_where = 'WHERE ' + ' AND '.join(game_conditions) if game_conditions else ''
+    team_conditions = game_conditions + (['pos_team IN %(teams)s'] if filters.get('team') is not None else [])
+    team_where = 'WHERE ' + ' AND '.join(team_conditions) if team_conditions else ''
 
-def team_stats_by_drive(connection, include_preseason=False):
     sum_columns_sql = ', '.join(_sum_query(col) for col in offense_team_stat_columns)
-    team_sums = pd.read_sql_query(
+    team_sums = db.submit(
+        executor, connection, db.read_sql_query,
         """SELECT gsis_id, drive_id, {}
             FROM drive
             INNER JOIN agg_play USING(gsis_id, drive_id)
             {}
+            {}
             GROUP BY gsis_id, drive_id
-        """.format(
-            sum_columns_sql,
-            '' if include_preseason else """
-            INNER JOIN game USING(gsis_id)
-            WHERE season_type != 'Preseason'
-            """
-        ),
+        """.format(sum_columns_sql, game_join, team_where),
         connection,
+        params=game_params,
         index_col=['gsis_id', 'drive_id'],
-    ).sort_index()
+    )
+    if not team_conditions:
+        drive = db.submit(
+            executor, connection, db.read_sql_table,
+            'drive', connection,
+            index_col=['gsis_id', 'drive_id'],
+        )
+    else:
+        drive = db.submit(
+            executor, connection, db.read_sql_query,
+            'SELECT drive.* FROM drive {} {}'.format(game_join, team_where),
+            connection,
+            params=game_params,
+            index_col=['gsis_id', 'drive_id'],
+        )
+    if vectorized:
+        timeline = db.submit(
+            executor, connection, score_timeline,
+            connection, include_preseason=include_preseason, season_weeks=season_weeks, **filters
+        )
+        games = db.submit(
+            executor, connection, db.read_sql_query,
+            'SELECT gsis_id, home_team, away_team FROM game {}'.format(game_where),
+            connection,
+            params=game_params,
+            index_col='gsis_id',
+        )
 
-    drive = pd.read_sql_table(
-        'drive', connection,
-        index_col=['gsis_id', 'drive_id'],
-    ).sort_index()
-    drive['team'] = drive['pos_team']
-    del drive['pos_team']
+    drive = drive.result().sort_index()
+    with trace.span('parse drives'):
+        drive['team'] = drive['pos_team']
+        del drive['pos_team']
 
-    for col in ['start_field', 'end_field', 'pos_time']:
-        drive.loc[~drive[col].isnull(), col] = _de_parenthesize(drive.loc[~drive[col].isnull(), col])
+        for col in ['start_field', 'end_field', 'pos_time']:
+            drive[col] = _de_parenthesize(drive[col])
 
-    for time_type in ['start', 'end']:
-        drive[time_type + '_quarter'], drive[time_type + '_time'] = process_time_col(drive[time_type + '_time'])
+        for time_type in ['start', 'end']:
+            drive[time_type + '_quarter'], drive[time_type + '_time'] = process_time_col(drive[time_type + '_time'])
+
+        drive = (pd.concat([drive, team_sums.result().sort_index()], axis=1, join='inner')
+                 .reset_index()
+                 .set_index(['gsis_id', 'team', 'drive_id'])
+                 .sort_index()
+                 )
+    if vectorized:
+        drive['offense_score'], drive['defense_score'] = _drive_scores(drive, timeline.result(), games.result())
+    else:
+        drive['offense_score'] = 0
+        drive['defense_score'] = 0
+        for name, row in drive.iterrows():
+            gsis_id, team, drive_id = name
+            scores = score_before_time(connection, gsis_id, row['start_quarter'], row['start_time'])
+            drive.loc[name, 'offense_score'] = scores[team]
+            drive.loc[name, 'defense_score'] = scores[scores.index != team].iloc[0]
+
+    return compact_frame(drive) if compact else drive
 
-    drive = (pd.concat([drive, team_sums], axis=1, join='inner')
-             .reset_index()
-             .set_index(['gsis_id', 'team', 'drive_id'])
-             .sort_index()
-             )
-    drive['offense_score'] = 0
-    drive['defense_score'] = 0
-    for name, row in drive.iterrows():
-        gsis_id, team, drive_id = name
-        scores = score_before_time(connection, gsis_id, row['start_quarter'], row['start_time'])
-        drive.loc[name, 'offense_score'] = scores[team]
-        drive.loc[name, 'defense_score'] = scores[scores.index != team][0]
 
-    return drive
+def team_stats_by_game(connection, include_preseason=False, after_gsis_id=None, season_weeks=None, compact=False,
+                       executor=None, **filters):
+    """Team box-score sums, points scored and points allowed in every game.
 
+    ``filters`` are applied in SQL as in ``player_stats_by_game``; ``team`` keeps only that team's rows.
 
-def team_stats_by_game(connection, include_preseason=False):
+    """
     team_stat_columns = offense_team_stat_columns + defense_team_stat_columns + special_team_stat_columns
     sum_columns_sql = ', '.join(_sum_query(column) for column in team_stat_columns)
-    team_sums = pd.read_sql_query(
-        """SELECT gsis_id, team, {}
+    game_conditions, game_params = db.game_conditions(include_preseason, after_gsis_id, season_weeks, **filters)
+    game_where = 'WHERE ' + ' AND '.join(game_conditions) if game_conditions else ''
+    team_sums = db.submit(
+        executor, connection, db.read_sql_query,
+        """SELECT gsis_id, play_player.team, {}
             FROM play_player
-            GROUP BY gsis_id, team
-        """.format(sum_columns_sql),
+            {}
+            {}
+            GROUP BY gsis_id, play_player.team
+        """.format(
+            sum_columns_sql,
+            'INNER JOIN game USING(gsis_id)' if game_conditions else '',
+            game_where,
+        ),
         connection,
+        params=game_params,
         index_col=['gsis_id', 'team'],
-    ).sort_index()
+    )
+    games = db.submit(
+        executor, connection, db.read_sql_query,
+        """SELECT gsis_id, start_time, week, season_year, season_type, home_team, away_team
+            FROM game
+            {}
+        """.format(game_where),
+        connection,
+        params=game_params,
+    )
 
+    team_sums = team_sums.result().sort_index()
     sum = _sum_cols(team_sums)
     team_sums['passing_plays'] = sum(['passing_att', 'passing_sk'])
     team_sums['offense_plays'] = sum(['passing_plays', 'rushing_att'])
@@ -167,10 +272,7 @@ def team_stats_by_game(connection, include_preseason=False):
     team_sums['defense_tds'] = sum(['defense_misc_tds', 'defense_frec_tds', 'defense_int_tds'], drop=True)
 
     games = pd.melt(
-        pd.read_sql_table(
-            'game', connection,
-            columns=['gsis_id', 'start_time', 'week', 'season_year', 'season_type', 'home_team', 'away_team'],
-        ),
+        games.result(),
         id_vars=['gsis_id', 'start_time', 'season_type', 'season_year', 'week'],
         value_vars=['home_team', 'away_team'],
         value_name='team',
@@ -179,32 +281,222 @@ def team_stats_by_game(connection, include_preseason=False):
     games['home'] = games['home'] == 'home_team'
     games = games.set_index(['gsis_id', 'team']).sort_index()
 
-    game_data = (pd.concat([games, team_sums], axis=1)
-                 .reset_index()
-                 .set_index(['gsis_id', 'home'])
-                 .sort_index()
-                 )
+    with trace.span('join games'):
+        game_data = (pd.concat([games, team_sums], axis=1)
+                     .reset_index()
+                     .set_index(['gsis_id', 'home'])
+                     .sort_index()
+                     )
 
-    if not include_preseason:
-        game_data.drop(game_data.index[game_data['season_type'] == 'Preseason'], axis=0, inplace=True)
+        game_data['offense_pts'] = scoring.points(game_data, offense_pts_by_stat)
+        game_data['defense_ptsa'] = (
+            game_data['offense_pts']
+            .sort_index(level=['gsis_id', 'home'], ascending=[True, False])
+            .values
+        )
+        if filters.get('team') is not None:
+            # Opponents' rows were only needed for points allowed.
+            game_data = game_data[game_data['team'].isin(game_params['teams'])]
 
-    game_data['offense_pts'] = (
-        game_data[
-            ['passing_tds', 'rushing_tds', 'passing_twoptm', 'rushing_twoptm', 'kicking_fgm', 'kicking_xpmade']
-        ] @ np.array([6, 6, 2, 2, 3, 1])
-    )
-    game_data['defense_ptsa'] = (
-        game_data['offense_pts']
-        .sortlevel('home', ascending=False)
-        .sortlevel('gsis_id', sort_remaining=False)
-        .values
+    return compact_frame(game_data) if compact else game_data
+
+
+def update_team_stats_by_game(connection, previous, season_weeks=None, **kwargs):
+    """Add new games to a frame from ``team_stats_by_game``; see ``update_player_stats_by_game``.
+
+    Scheduled games that have no stats yet are queried again on the next update.
+
+    """
+    return _update_by_game(team_stats_by_game, connection, previous, season_weeks, kwargs,
+                           played_column='offense_plays')
+
+
+def build(connection, frames=('games', 'drives', 'players'), season_weeks=None, executor=None, max_workers=4,
+          **kwargs):
+    """Several of the frames in ``frame_builders`` at once, as a dict keyed by name.
+
+    The frames are built concurrently, and their queries share ``executor``
+    (by default a thread pool of ``max_workers``), each on its own connection from ``connection``'s pool.
+    ``season_weeks`` and ``kwargs`` are passed to every builder;
+    ``frames`` can also be a dict mapping each name to keyword arguments for its builder alone.
+
+    """
+    if not isinstance(frames, dict):
+        frames = {name: {} for name in frames}
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    # Builders wait on their queries, so they get threads of their own rather than workers of ``executor``.
+    builders = ThreadPoolExecutor(max_workers=len(frames)) if db.pooled(connection) else None
+    try:
+        futures = {
+            name: db.submit(
+                builders, connection, frame_builders[name],
+                connection, season_weeks=season_weeks, executor=executor, **dict(kwargs, **frame_kwargs)
+            )
+            for name, frame_kwargs in frames.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        if builders is not None:
+            builders.shutdown()
+        if own_executor:
+            executor.shutdown()
+
+
+def iter_partitions(connection, stats_by_game=player_stats_by_game, by='season_year', **kwargs):
+    """Yield ``(partition, frame)`` pairs from ``stats_by_game``, one call per distinct value of ``by`` in ``game``,
+    in order of each partition's first game.
+
+    ``by`` is a game column or a list of them (e.g. ``['season_year', 'season_type', 'week']``);
+    ``partition`` is a dict of their values, passed to ``stats_by_game`` as filters along with ``kwargs``.
+    Peak memory is bounded by the largest partition rather than the whole database.
+    If ``stats_by_game`` is given a ``chunksize``, each of its chunks is yielded with its partition.
+
+    """
+    for partition in _partitions(connection, by, kwargs):
+        frames = stats_by_game(connection, **dict(kwargs, **partition))
+        for frame in [frames] if isinstance(frames, pd.DataFrame) else frames:
+            yield partition, frame
+
+
+def concat_partitions(connection, stats_by_game=team_stats_by_game, by='season_year', executor=None,
+                      max_workers=None, **kwargs):
+    """One frame from ``stats_by_game``, built a partition at a time (as in ``iter_partitions``) across processes.
+
+    ``connection`` is a SQLAlchemy engine or connection, or a database URL,
+    naming a database other processes can open (not an in-memory one);
+    each worker process opens its own engine for the URL.
+    Partitions run on ``executor``, by default a process pool of ``max_workers`` (all cores).
+    They are taken in order of their first game, so the frames concatenate in index order
+    for any ``by`` that never splits a game, and are only sorted again if they do not.
+    Whole frames are returned, so ``chunksize`` is not supported; stream with ``iter_partitions`` instead.
+
+    """
+    from sqlalchemy import make_url
+    if kwargs.get('chunksize') is not None:
+        raise ValueError('concat_partitions builds whole frames; use iter_partitions to stream chunks')
+    url = make_url(connection) if isinstance(connection, str) else getattr(connection, 'engine', connection).url
+    if cache.in_memory(url):
+        raise ValueError('Worker processes cannot open the in-memory database {}'.format(url))
+    url = url.render_as_string(hide_password=False)
+    engine = db.connect(url) if isinstance(connection, str) else connection
+    partitions = list(_partitions(engine, by, kwargs))
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = [
+            executor.submit(_build_partition, url, stats_by_game, dict(kwargs, **partition))
+            for partition in partitions
+        ]
+        frames = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    if not frames:
+        # Nothing is selected, so this is an empty frame with the usual columns.
+        return stats_by_game(engine, **kwargs)
+    combined = pd.concat(frames)
+    return combined if combined.index.is_monotonic_increasing else combined.sort_index()
+
+
+def write_partitions(partitions, path):
+    """Write ``(partition, frame)`` pairs, e.g. from ``iter_partitions``, as a Hive-partitioned Parquet dataset.
+
+    Each frame goes to its own file, like ``path/season_year=2015/part-0.parquet``,
+    so only one frame is held at a time; read it back with ``pd.read_parquet(path)``.
+    Requires ``pyarrow``. Returns the paths written.
+
+    """
+    parts = {}
+    paths = []
+    for partition, frame in partitions:
+        directory = os.path.join(path, *('{}={}'.format(column, value) for column, value in partition.items()))
+        os.makedirs(directory, exist_ok=True)
+        part = parts[directory] = parts.get(directory, -1) + 1
+        paths.append(os.path.join(directory, 'part-{}.parquet'.format(part)))
+        # Partition columns are read back from the path.
+        frame.drop(columns=[column for column in partition if column in frame.columns]).to_parquet(paths[-1])
+    return paths
+
+
+def _partitions(connection, by, kwargs):
+    """A dict of the values of ``by`` for each partition of the games ``kwargs`` select, in order of first game."""
+    by = [by] if isinstance(by, str) else list(by)
+    game_kwargs = {key: kwargs[key] for key in _game_filters if key in kwargs}
+    conditions, params = db.game_conditions(**dict(dict(include_preseason=False), **game_kwargs))
+    keys = db.read_sql_query(
+        'SELECT {0}, MIN(gsis_id) AS first_gsis_id FROM game {1} GROUP BY {0} ORDER BY first_gsis_id'.format(
+            ', '.join(by),
+            'WHERE ' + ' AND '.join(conditions) if conditions else '',
+        ),
+        connection,
+        params=params,
     )
+    for values in keys[by].itertuples(index=False):
+        yield {column: value.item() if hasattr(value, 'item') else value for column, value in zip(by, values)}
+
+
+def _build_partition(url, stats_by_game, kwargs):
+    # Engines are kept per process, and forked children must not reuse their parent's.
+    key = os.getpid(), url
+    if key not in _worker_engines:
+        _worker_engines[key] = db.connect(url)
+    return stats_by_game(_worker_engines[key], **kwargs)
+
 
-    return game_data
+def _update_by_game(stats_by_game, connection, previous, season_weeks, kwargs, played_column=None):
+    path = None
+    if isinstance(previous, str):
+        path = previous
+        previous = pd.read_pickle(path) if os.path.exists(path) else None
+
+    if previous is None or not previous.shape[0]:
+        combined = stats_by_game(connection, season_weeks=season_weeks, **kwargs)
+    elif season_weeks is not None:
+        new = stats_by_game(connection, season_weeks=season_weeks, **kwargs)
+        replaced = previous.index.get_level_values('gsis_id').isin(new.index.get_level_values('gsis_id'))
+        # Concatenating an empty frame would turn string columns to object.
+        combined = pd.concat([previous[~replaced], new]).sort_index() if new.shape[0] else previous
+    else:
+        gsis_ids = previous.index.get_level_values('gsis_id')
+        played = gsis_ids if played_column is None else gsis_ids[previous[played_column].notnull().values]
+        last = played.max()
+        new = stats_by_game(connection, after_gsis_id=last, **kwargs)
+        # Every new gsis_id sorts after the kept ones, so the concatenation is already sorted.
+        # With no new games there are none after ``last`` either, so ``previous`` is unchanged.
+        combined = pd.concat([previous[gsis_ids <= last], new]) if new.shape[0] else previous
+
+    if path is not None:
+        combined.to_pickle(path)
+    return combined
+
+
+def _processed_chunks(chunks, compact):
+    for chunk in chunks:
+        yield compact_frame(chunk) if compact else chunk
+
+
+def _drive_scores(drive, timeline, games):
+    gsis_ids = drive.index.get_level_values('gsis_id')
+    teams = drive.index.get_level_values('team')
+    home_team = games['home_team'].reindex(gsis_ids).values
+    away_team = games['away_team'].reindex(gsis_ids).values
+    opponents = np.where(teams == home_team, away_team, home_team)
+    clocks = game_clock(drive['start_quarter'], drive['start_time'])
+
+    with trace.span('drive scores'):
+        return (
+            scores_before(timeline, gsis_ids, teams, clocks),
+            scores_before(timeline, gsis_ids, opponents, clocks),
+        )
 
 
 def _de_parenthesize(series, type_=int):
-    return series.str.strip('()').astype(int)
+    stripped = series.str.strip('()')
+    return stripped.astype(float) if stripped.isnull().any() else stripped.astype(type_)
 
 
 def _sum_query(col):
@@ -217,3 +509,10 @@ def _sum_cols(df, cols, drop=False):
     if drop:
         df.drop(cols, axis=1, inplace=True)
     return series
+
+
+frame_builders = {
+    'games': team_stats_by_game,
+    'drives': team_stats_by_drive,
+    'players': player_stats_by_game,
+}
@@ -1,12 +1,31 @@
-from pkg_resources import resource_stream
+from itertools import product
 from toolz import memoize
-import yaml
+import numpy as np
 import pandas as pd
 
-from nfldata.common import process_time_col, is_before
-
-
-@memoize
+from nfldata import db, names, reference, scoring, trace
+from nfldata.cache import memoize_lookup
+from nfldata.common import game_clock, time_col_clock, levenshtein
+
+offense_pts_by_stat = {
+    'rushing_tds': 6,
+    'passing_tds': 6,
+    'rushing_twoptm': 2,
+    'passing_twoptm': 2,
+    'kicking_fgm': 3,
+    'kicking_xpmade': 1,
+}
+defense_pts_by_stat = {
+    'defense_frec_tds': 6,
+    'defense_int_tds': 6,
+    'defense_misc_tds': 6,
+    'defense_safe': 2,
+    'kickret_tds': 6,
+    'puntret_tds': 6,
+}
+
+
+@memoize_lookup(maxsize=2**14)
 def gsis_id(connection, season_year, week, team, season_type='Regular', lookup_home=False, lookup_opp=False):
     query = """
         SELECT gsis_id{}{}
@@ -19,7 +38,7 @@ def gsis_id(connection, season_year, week, team, season_type='Regular', lookup_h
         ', home_team = %(team)s AS home' if lookup_home else '',
         ', CASE WHEN home_team = %(team)s THEN away_team ELSE home_team END AS opp' if lookup_opp else '',
     )
-    result = pd.read_sql_query(query, connection, params=dict(
+    result = db.read_sql_query(query, connection, params=dict(
         season_type=season_type,
         season_year=season_year,
         week=week,
@@ -29,13 +48,72 @@ def gsis_id(connection, season_year, week, team, season_type='Regular', lookup_h
     game_str = '{} in {} week {} ({})'.format(team, season_year, week, season_type)
     if result.shape[0] > 1:
         raise ValueError('Found more than one game for {}'.format(game_str))
-    if not result.shape:
+    if not result.shape[0]:
         raise ValueError('Could not find game for {}'.format(game_str))
 
     return result.iloc[0, :]
 
 
-@memoize
+def gsis_ids(connection, frame, lookup_home=False, lookup_opp=False):
+    """Vectorized ``gsis_id`` over every row of ``frame``, using a single query.
+
+    ``frame`` needs ``season_year``, ``week`` and ``team`` columns,
+    and may have ``season_type`` (otherwise ``'Regular'`` is assumed).
+    Returns a frame indexed like ``frame`` with a ``gsis_id`` column,
+    plus ``home`` and ``opp`` columns if requested.
+    Raises a single ``ValueError`` listing every ambiguous or missing game.
+
+    """
+    columns = ['gsis_id'] + (['home'] if lookup_home else []) + (['opp'] if lookup_opp else [])
+    keys = pd.DataFrame(dict(
+        season_year=np.asarray(frame['season_year'], dtype=int),
+        week=np.asarray(frame['week'], dtype=int),
+        season_type=frame['season_type'].values if 'season_type' in frame else 'Regular',
+        team=frame['team'].values,
+        row=np.arange(len(frame)),
+    ))
+    if not len(keys):
+        return pd.DataFrame(columns=columns, index=frame.index)
+
+    week_keys = ['season_year', 'week', 'season_type']
+    weeks = tuple(
+        (int(season_year), int(week), str(season_type))
+        for season_year, week, season_type in keys[week_keys].drop_duplicates().itertuples(index=False)
+    )
+    games = db.read_sql_query(
+        """SELECT gsis_id, season_year, week, season_type, home_team, away_team
+            FROM game
+            WHERE (season_year, week, season_type) IN %(weeks)s
+        """,
+        connection,
+        params=dict(weeks=weeks),
+    )
+    games_by_team = pd.concat([
+        games.assign(team=games['home_team'], home=True, opp=games['away_team']),
+        games.assign(team=games['away_team'], home=False, opp=games['home_team']),
+    ], ignore_index=True)[week_keys + ['team', 'gsis_id', 'home', 'opp']]
+
+    matched = keys.merge(games_by_team, how='left', on=week_keys + ['team'])
+    n_games = matched.groupby('row')['gsis_id'].count()
+
+    def game_strs(rows):
+        return '\n'.join(
+            '    {} in {} week {} ({})'.format(team, season_year, week, season_type)
+            for season_year, week, season_type, team
+            in keys.loc[rows, week_keys + ['team']].drop_duplicates().itertuples(index=False)
+        )
+
+    if (n_games > 1).any():
+        raise ValueError('Found more than one game for:\n{}'.format(game_strs(n_games.index[n_games > 1])))
+    if (n_games == 0).any():
+        raise ValueError('Could not find game for:\n{}'.format(game_strs(n_games.index[n_games == 0])))
+
+    result = matched[columns]
+    result.index = frame.index
+    return result
+
+
+@memoize_lookup(maxsize=2**16, ignore=('team',))
 def player_id(connection, name, pos, team=None):
     hardcoded_player_ids = _get_hardcoded_player_ids()
     if (name, pos) in hardcoded_player_ids:
@@ -46,7 +124,7 @@ def player_id(connection, name, pos, team=None):
     else:
         position_where = 'position = %(pos)s'
 
-    result = pd.read_sql_query(
+    result = db.read_sql_query(
         """SELECT player_id
             FROM player
             WHERE full_name = %(name)s
@@ -57,9 +135,9 @@ def player_id(connection, name, pos, team=None):
         ),
     )
 
-    player_str = '{} ({}{})'.format(name, pos, '-' + team if team else '')
+    player_str = _player_str(name, pos, team)
     if not result.shape[0]:
-        unk_pos_result = pd.read_sql_query(
+        unk_pos_result = db.read_sql_query(
             """SELECT player_id
                 FROM player
                 WHERE full_name = %(name)s
@@ -68,8 +146,8 @@ def player_id(connection, name, pos, team=None):
         if unk_pos_result.shape[0] == 1:
             return unk_pos_result.iloc[0, 0]
 
-        fuzzy_results = pd.read_sql_query(
-            """SELECT player_id, levenshtein(%(name)s, full_name), full_name, position, team
+        fuzzy_results = db.read_sql_query(
+            """SELECT player_id, levenshtein(%(name)s, full_name) AS levenshtein, full_name, position, team
                 FROM player
                 WHERE (levenshtein(%(name)s, full_name) < 7 AND {})
                     OR levenshtein(%(name)s, full_name) < 3
@@ -81,17 +159,14 @@ def player_id(connection, name, pos, team=None):
         )
 
         if not fuzzy_results.shape[0]:
-            fuzzy_results = pd.read_sql_query(
-                """SELECT player_id, levenshtein(%(name)s, full_name), full_name, position, team
+            fuzzy_results = db.read_sql_query(
+                """SELECT player_id, levenshtein(%(name)s, full_name) AS levenshtein, full_name, position, team
                     FROM player
                     WHERE levenshtein(%(name)s, full_name) < 7
                     ORDER BY levenshtein
                 """, connection, params=dict(name=name), index_col='player_id')
 
-        raise ValueError('No hits found for {}, {}'.format(
-            player_str,
-            'could be:\n\n{}'.format(fuzzy_results) if fuzzy_results.shape[0] else 'no similar names found',
-        ))
+        raise ValueError('No hits found for {}, {}'.format(player_str, _similar_str(fuzzy_results)))
 
     if result.shape[0] > 1:
         raise ValueError('Multiple hits found for {}:\n\n{}'.format(
@@ -101,13 +176,198 @@ def player_id(connection, name, pos, team=None):
     return result.iloc[0, 0]
 
 
-def score_before_time(connection, gsis_id_, before_quarter, before_time):
+@memoize_lookup(maxsize=8)
+def player_index(connection):
+    return PlayerIndex.from_connection(connection)
+
+
+def preload_games(connection, season_years=None):
+    """Fill ``gsis_id``'s cache with every game (or those of ``season_years``) from one query.
+
+    ``gsis_id``'s cache grows to hold all of them, and ``home`` is computed by the database,
+    so preloaded rows are the ones ``gsis_id`` would have queried.
+
+    """
+    games = db.read_sql_query(
+        """SELECT gsis_id, season_year, week, season_type, home_team, away_team,
+                home_team = home_team AS home, away_team = home_team AS away
+            FROM game
+            {}
+        """.format('WHERE season_year IN %(season_years)s' if season_years is not None else ''),
+        connection,
+        params=dict(season_years=tuple(season_years)) if season_years is not None else None,
+    )
+    # Two teams, each with four combinations of lookup_home and lookup_opp.
+    gsis_id.cache.maxsize = max(gsis_id.cache.maxsize, 8 * len(games))
+    sides = pd.concat([
+        games.drop(columns='away').rename(columns={'home_team': 'team', 'away_team': 'opp'}),
+        games.drop(columns='home').rename(columns={'away_team': 'team', 'home_team': 'opp', 'away': 'home'}),
+    ], ignore_index=True)
+    for lookup_home, lookup_opp in product([False, True], repeat=2):
+        columns = ['gsis_id'] + (['home'] if lookup_home else []) + (['opp'] if lookup_opp else [])
+        # Rows taken from a frame, as ``gsis_id`` takes them from its query's.
+        rows = sides[columns]
+        for i, side in enumerate(sides.itertuples(index=False)):
+            gsis_id.preload(rows.iloc[i, :].rename(0), connection, int(side.season_year), int(side.week), side.team,
+                            season_type=side.season_type, lookup_home=lookup_home, lookup_opp=lookup_opp)
+    return len(games)
+
+
+def preload_players(connection):
+    """Fill ``player_id``'s cache with every unambiguous (name, position), from the player index."""
+    ids = player_index(connection).unique_ids()
+    for (name, pos), id_ in ids.items():
+        player_id.preload(id_, connection, name, pos)
+    return len(ids)
+
+
+class PlayerIndex:
+    """All of nfldb's players held in memory, for resolving many names at once.
+
+    Resolution follows ``player_id``:
+    hardcoded ids first, then an exact (name, position) match
+    (RBs may also match FBs), then a unique match among players of unknown position.
+    Fuzzy suggestions for unresolved names come from a local trigram index
+    rather than from server-side ``levenshtein()``.
+
+    """
+    trigram_candidates = 200
+
+    def __init__(self, players, hardcoded_ids=None):
+        self.players = players[['player_id', 'full_name', 'position', 'team']].reset_index(drop=True)
+        self.hardcoded_ids = _get_hardcoded_player_ids() if hardcoded_ids is None else hardcoded_ids
+
+        fullbacks = self.players[self.players['position'] == 'FB']
+        self._by_name_pos = pd.concat([self.players, fullbacks.assign(position='RB')], ignore_index=True)
+
+        unk = self.players[self.players['position'] == 'UNK']
+        unk_counts = unk['full_name'].value_counts()
+        self._unk_ids = unk[unk['full_name'].isin(unk_counts.index[unk_counts == 1])].set_index('full_name')['player_id']
+
+        self._names = None
+        self._postings = None
+
+    def unique_ids(self):
+        """Player ids by (name, position): the hardcoded ones, and every other pair with exactly one match."""
+        counts = self._by_name_pos.groupby(['full_name', 'position'])['player_id'].transform('size')
+        ids = (self._by_name_pos[counts == 1]
+               .set_index(['full_name', 'position'])['player_id']
+               .rename_axis(['name', 'pos'])
+               )
+        hardcoded = pd.Series(
+            list(self.hardcoded_ids.values()),
+            index=pd.MultiIndex.from_tuples(list(self.hardcoded_ids), names=['name', 'pos']),
+            dtype=object,
+        )
+        return pd.concat([ids[~ids.index.isin(hardcoded.index)], hardcoded])
+
+    @classmethod
+    def from_connection(cls, connection):
+        return cls(db.read_sql_query(
+            """SELECT player_id, full_name, position, team
+                FROM player
+            """, connection,
+        ))
+
+    def resolve(self, names, positions, teams=None):
+        """Player ids for aligned sequences of names, positions and (optionally) teams.
+
+        Returns a Series indexed like ``names``.
+        Raises a single ``ValueError`` describing every name that could not be resolved.
+
+        """
+        index = names.index if isinstance(names, pd.Series) else pd.RangeIndex(len(names))
+        queries = pd.DataFrame(dict(
+            name=np.asarray(names, dtype=object),
+            pos=np.asarray(positions, dtype=object),
+            team=np.asarray(teams, dtype=object) if teams is not None else None,
+        ))
+        unique = queries.drop_duplicates(['name', 'pos']).reset_index(drop=True)
+        unique['player_id'] = [self.hardcoded_ids.get(key) for key in zip(unique['name'], unique['pos'])]
+
+        unresolved = unique['player_id'].isnull()
+        hits = unique[unresolved][['name', 'pos']].merge(
+            self._by_name_pos, left_on=['name', 'pos'], right_on=['full_name', 'position'],
+        )
+        n_hits = hits.groupby(['name', 'pos'])['player_id'].count()
+        exact = hits.drop_duplicates(['name', 'pos'], keep=False).set_index(['name', 'pos'])['player_id']
+        keys = pd.MultiIndex.from_frame(unique[['name', 'pos']])
+        unique.loc[unresolved, 'player_id'] = exact.reindex(keys[unresolved]).values
+
+        no_hits = unresolved & ~keys.isin(n_hits.index)
+        unique.loc[no_hits, 'player_id'] = self._unk_ids.reindex(unique.loc[no_hits, 'name']).values
+
+        multiple = unique.index[keys.isin(n_hits.index[n_hits > 1])]
+        missing = unique.index[no_hits & unique['player_id'].isnull()]
+        if len(multiple) or len(missing):
+            errors = [
+                'Multiple hits found for {}:\n\n{}'.format(
+                    _player_str(name, pos, team),
+                    hits[(hits['name'] == name) & (hits['pos'] == pos)].set_index('player_id')[['full_name', 'position', 'team']],
+                )
+                for name, pos, team in unique.loc[multiple, ['name', 'pos', 'team']].itertuples(index=False)
+            ] + [
+                'No hits found for {}, {}'.format(
+                    _player_str(name, pos, team),
+                    _similar_str(self.similar(name, pos)),
+                )
+                for name, pos, team in unique.loc[missing, ['name', 'pos', 'team']].itertuples(index=False)
+            ]
+            raise ValueError('Could not resolve {} players:\n\n{}'.format(len(errors), '\n\n'.join(errors)))
+
+        ids = unique.set_index(['name', 'pos'])['player_id']
+        return pd.Series(
+            ids.reindex(pd.MultiIndex.from_frame(queries[['name', 'pos']])).values,
+            index=index, name='player_id',
+        )
+
+    def similar(self, name, pos=None):
+        """Players with names close to ``name``, using the same cutoffs as ``player_id``."""
+        candidates = self.players[self.players['full_name'].isin(self._trigram_candidates(name))]
+        candidates = candidates.assign(levenshtein=[levenshtein(name, full_name) for full_name in candidates['full_name']])
+        if pos is not None:
+            same_pos = candidates['position'].isin(['RB', 'FB'] if pos == 'RB' else [pos])
+            close = candidates[((candidates['levenshtein'] < 7) & same_pos) | (candidates['levenshtein'] < 3)]
+            if close.shape[0]:
+                candidates = close
+        return (candidates[candidates['levenshtein'] < 7]
+                .sort_values('levenshtein', kind='mergesort')
+                .set_index('player_id')[['levenshtein', 'full_name', 'position', 'team']]
+                )
+
+    def _trigram_candidates(self, name):
+        if self._names is None:
+            self._build_trigram_index()
+        postings = [self._postings[gram] for gram in _trigrams(name) if gram in self._postings]
+        if not postings:
+            return self._names[:0]
+        shared = np.bincount(np.concatenate(postings), minlength=len(self._names))
+        best = np.argsort(-shared, kind='mergesort')[:self.trigram_candidates]
+        return self._names[best[shared[best] > 0]]
+
+    def _build_trigram_index(self):
+        self._names = self.players['full_name'].dropna().unique()
+        postings = {}
+        for i, full_name in enumerate(self._names):
+            for gram in _trigrams(full_name):
+                postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.array(ixs) for gram, ixs in postings.items()}
+
+
+def score_before_time(connection, gsis_id_, before_quarter, before_time, timelines=None):
+    """Each team's score before a time in a game, as a Series indexed by team.
+
+    With ``timelines`` (a ``timeline.GameTimelines`` that covers the game), no queries are run.
+
+    """
+    if timelines is not None:
+        return timelines.score_before(gsis_id_, before_quarter, before_time)
     play_ids = plays_before_time(connection, gsis_id_, before_quarter, before_time)
     return _total_score_over_plays(connection, gsis_id_, play_ids)
 
 
 def plays_before_time(connection, gsis_id_, before_quarter, before_time):
-    quarter, time = process_time_col(pd.read_sql_query(
+    plays = db.read_sql_query(
         """SELECT play_id, time
             FROM play
             WHERE gsis_id = %(gsis_id)s
@@ -115,15 +375,83 @@ def plays_before_time(connection, gsis_id_, before_quarter, before_time):
         connection,
         index_col='play_id',
         params=dict(gsis_id=gsis_id_),
-    ).sort_index()['time'])
-    return [
-        int(play_id) for play_id in
-        quarter.index[is_before(quarter, time, before_quarter, before_time)]
-    ]
+    ).sort_index()
+    before = time_col_clock(plays['time']) < game_clock([before_quarter], [before_time])[0]
+    return [int(play_id) for play_id in plays.index[before]]
+
+
+def score_timeline(connection, include_preseason=True, season_weeks=None, **filters):
+    """Running score of every team in every game, from one bulk query.
+
+    Returns one row per (gsis_id, team, clock) at which the team scored,
+    where ``clock`` is a game-clock ordinal (see ``common.game_clock``)
+    and ``score`` is the team's total including that clock's points.
+    Points are credited as in ``score_before_time``:
+    offensive points to ``pos_team``, defensive and return points to the other team.
+    ``filters`` select games as in ``historical.player_stats_by_game``.
+
+    """
+    offense_sql = scoring.sql_expression(offense_pts_by_stat)
+    defense_sql = scoring.sql_expression(defense_pts_by_stat)
+    game_conditions, game_params = db.game_conditions(include_preseason, season_weeks=season_weeks, **filters)
+    plays = db.read_sql_query(
+        """SELECT gsis_id, time, pos_team, home_team, away_team,
+                {0} AS offense_pts, {1} AS defense_pts
+            FROM agg_play
+            INNER JOIN play USING(gsis_id, play_id)
+            INNER JOIN game USING(gsis_id)
+            WHERE pos_team != 'UNK'
+              AND {0} + {1} > 0
+              {2}
+        """.format(
+            offense_sql,
+            defense_sql,
+            ' '.join('AND ' + condition for condition in game_conditions),
+        ),
+        connection,
+        params=game_params,
+    )
+
+    with trace.span('score timeline'):
+        return _score_timeline(plays)
+
+
+def _score_timeline(plays):
+    clock = time_col_clock(plays['time'])
+    defense_team = np.where(plays['pos_team'] == plays['home_team'], plays['away_team'], plays['home_team'])
+    changes = pd.concat([
+        pd.DataFrame(dict(gsis_id=plays['gsis_id'], team=plays['pos_team'], clock=clock, points=plays['offense_pts'])),
+        pd.DataFrame(dict(gsis_id=plays['gsis_id'], team=defense_team, clock=clock, points=plays['defense_pts'])),
+    ], ignore_index=True)
+
+    timeline = (changes[changes['points'] > 0]
+                .groupby(['gsis_id', 'team', 'clock'])['points'].sum()
+                .reset_index()
+                )
+    timeline['score'] = timeline.groupby(['gsis_id', 'team'])['points'].cumsum()
+    return timeline
+
+
+def scores_before(timeline, gsis_ids, teams, clocks):
+    """Each team's score strictly before the given game clocks, as an as-of join against ``score_timeline``."""
+    keys = pd.DataFrame(dict(
+        gsis_id=np.asarray(gsis_ids),
+        team=np.asarray(teams),
+        clock=np.asarray(clocks, dtype=np.int64),
+        order=np.arange(len(gsis_ids)),
+    )).sort_values('clock', kind='mergesort')
+    right = timeline[['gsis_id', 'team', 'clock', 'score']].astype(dict(clock=np.int64)).sort_values('clock', kind='mergesort')
+
+    merged = pd.merge_asof(
+        keys, right,
+        on='clock', by=['gsis_id', 'team'],
+        allow_exact_matches=False,
+    )
+    return merged.sort_values('order')['score'].fillna(0).astype(int).values
 
 
 def _teams(connection, gsis_id_):
-    return pd.read_sql_query(
+    return db.read_sql_query(
             """SELECT home_team, away_team
                 FROM game
                 WHERE gsis_id = %(gsis_id)s
@@ -141,26 +469,10 @@ def _total_score_over_plays(connection, gsis_id_, play_ids):
     if not len(play_ids):
         return pd.Series([0, 0], _teams(connection, gsis_id_), name='score')
 
-    offense_pts_by_stat = {
-        'rushing_tds': 6,
-        'passing_tds': 6,
-        'rushing_twoptm': 2,
-        'passing_twoptm': 2,
-        'kicking_fgm': 3,
-        'kicking_xpmade': 1,
-    }
-    defense_pts_by_stat = {
-        'defense_frec_tds': 6,
-        'defense_int_tds': 6,
-        'defense_misc_tds': 6,
-        'defense_safe': 2,
-        'kickret_tds': 6,
-        'puntret_tds': 6,
-    }
-    offense_sql = ' + '.join('{}*SUM({})'.format(points, stat) for stat, points in offense_pts_by_stat.items())
-    defense_sql = ' + '.join('{}*SUM({})'.format(points, stat) for stat, points in defense_pts_by_stat.items())
+    offense_sql = scoring.sql_expression(offense_pts_by_stat, 'SUM')
+    defense_sql = scoring.sql_expression(defense_pts_by_stat, 'SUM')
 
-    offense_scores = pd.read_sql_query(
+    offense_scores = db.read_sql_query(
         """SELECT pos_team AS team, {} AS score
             FROM agg_play
             INNER JOIN play USING(gsis_id, play_id)
@@ -176,7 +488,7 @@ def _total_score_over_plays(connection, gsis_id_, play_ids):
     if offense_scores.shape[0] == 1:
         offense_scores[_other_team(connection, gsis_id_, offense_scores.index[0])] = 0
 
-    defense_scores = pd.read_sql_query(
+    defense_scores = db.read_sql_query(
         """SELECT pos_team AS team, {} AS score
             FROM agg_play
             INNER JOIN play USING(gsis_id, play_id)
@@ -197,18 +509,25 @@ def _total_score_over_plays(connection, gsis_id_, play_ids):
     return offense_scores + defense_scores
 
 
+def _player_str(name, pos, team=None):
+    return '{} ({}{})'.format(name, pos, '-' + team if team and not pd.isnull(team) else '')
+
+
+def _similar_str(similar):
+    return 'could be:\n\n{}'.format(similar) if similar.shape[0] else 'no similar names found'
+
+
+def _trigrams(str_):
+    padded = '  {} '.format(str_.lower())
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
 @memoize
 def _get_hardcoded_player_ids():
     hardcoded_ids = {
         tuple(k.split('; ')): v
-        for k, v in yaml.load(resource_stream(__name__, 'data/hardcoded_player_ids.yaml')).items()
+        for k, v in reference.load('hardcoded_player_ids').items()
     }
-
-    teams = yaml.load(resource_stream(__name__, 'data/teams.yaml'))
-    for team_variations in teams:
-        canonical = team_variations[0]
-        for variation in team_variations:
-            hardcoded_ids[variation, 'DST'] = canonical
-            hardcoded_ids[variation + ' Defense', 'DST'] = canonical
-
+    for variation, abbreviation in names.team_abbreviations().items():
+        hardcoded_ids[variation, names.dst] = abbreviation
     return hardcoded_ids
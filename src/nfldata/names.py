@@ -0,0 +1,96 @@
+"""Canonical player names, positions and team abbreviations for whole columns at once.
+
+The variant tables (``data/teams.yaml``, and each site's ``name_fixes`` and ``position_fixes``
+in ``data/dfs_sites.yaml``) compile into one dict per column for a site,
+and a column is recoded by looking up each of its distinct values once::
+
+    normalizer = Normalizer('fanduel')
+    salaries = normalizer.normalize(salaries)  # one ValueError lists every unknown team
+    normalizer.unmapped(normalizer.normalize(projections, errors='ignore'))
+
+Teams become nfldb abbreviations and site names become the names projections use (the keys of ``name_fixes``).
+Team defenses (``DST``) are named by their team's abbreviation, as ``lookup.player_id`` resolves them.
+
+"""
+from toolz import memoize
+import numpy as np
+import pandas as pd
+
+from nfldata import reference
+
+dst = 'DST'
+
+
+@memoize
+def team_abbreviations():
+    """The nfldb abbreviation of every variant of a team's name in ``data/teams.yaml``, and of its ``X Defense`` form."""
+    abbreviations = {}
+    for variations in reference.load('teams'):
+        for variation in variations:
+            abbreviations[variation] = variations[0]
+            abbreviations[variation + ' Defense'] = variations[0]
+    return abbreviations
+
+
+def recode(values, mapping):
+    """``values`` (a Series) with each one in ``mapping`` replaced, looking up every distinct value once."""
+    codes, uniques = pd.factorize(values)
+    # Missing values have code -1, the trailing None.
+    recoded = np.array([mapping.get(value, value) for value in uniques] + [None], dtype=object)
+    return pd.Series(recoded[codes], index=values.index, name=values.name)
+
+
+class Normalizer:
+    def __init__(self, site=None):
+        """Lookups for the files of ``site`` (one in ``data/dfs_sites.yaml``), or only the team lookup for none."""
+        config = reference.load('dfs_sites')[site.lower()] if site is not None else {}
+        self.teams = team_abbreviations()
+        self.names = {site_name: name for name, site_name in config.get('name_fixes', {}).items()}
+        self.positions = config.get('position_fixes', {})
+        self._abbreviations = set(self.teams.values())
+
+    def normalize(self, frame, errors='raise'):
+        """A copy of ``frame`` with whichever of its ``name``, ``pos`` and ``team`` columns it has made canonical.
+
+        A defense without a team gets the one its name gives, if any.
+        With ``errors='raise'``, raises a single ``ValueError`` listing every value ``unmapped`` finds.
+
+        """
+        frame = frame.copy()
+        if 'pos' in frame:
+            frame['pos'] = recode(frame['pos'], self.positions)
+        if 'team' in frame:
+            frame['team'] = recode(frame['team'], self.teams)
+        if 'name' in frame:
+            frame['name'] = recode(frame['name'], self.names)
+            if 'pos' in frame:
+                is_dst = (frame['pos'] == dst).values
+                frame.loc[is_dst, 'name'] = recode(frame.loc[is_dst, 'name'], self.teams)
+                if 'team' in frame:
+                    no_team = is_dst & frame['team'].isnull().values & frame['name'].isin(self._abbreviations).values
+                    frame.loc[no_team, 'team'] = frame.loc[no_team, 'name']
+
+        if errors == 'raise':
+            unmapped = self.unmapped(frame)
+            if len(unmapped):
+                raise ValueError('Could not normalize {} values:\n\n{}'.format(
+                    len(unmapped), unmapped.to_string(index=False),
+                ))
+        return frame
+
+    def unmapped(self, frame):
+        """The distinct teams, and names of defenses, in a normalized ``frame`` that are not abbreviations,
+        with how many rows have each.
+
+        """
+        found = []
+        if 'team' in frame:
+            found.append(('team', frame['team'][frame['team'].notnull() & ~frame['team'].isin(self._abbreviations)]))
+        if 'name' in frame and 'pos' in frame:
+            names = frame['name'][frame['pos'] == dst]
+            found.append(('name', names[~names.isin(self._abbreviations)]))
+        return pd.DataFrame(
+            [(column, value, rows) for column, values in found
+             for value, rows in values.value_counts(dropna=False).items()],
+            columns=['column', 'value', 'rows'],
+        )
@@ -1,42 +1,122 @@
-from pkg_resources import resource_stream
-from toolz import memoize, curry
-import yaml
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import logging
+import time
+from toolz import memoize
 import pandas as pd
 
-from nfldata import lookup
+from nfldata import lookup, reference, trace
+
+logger = logging.getLogger(__name__)
 
 
 def load_by_week(connection, week_loader, weeks_by_season, **kwargs):
-    all_dfs = []
-    for season_year, weeks in weeks_by_season.items():
-        for week in weeks:
-            if 'season_type' in kwargs:
-                season_type = kwargs['season_type']
-            elif week > 17:
-                season_type = 'Postseason'
+    season_type = kwargs.pop('season_type', None)
+    all_dfs = [
+        _load_week(week_loader, season_year, week, season_type)[0]
+        for season_year, week in _season_weeks(weeks_by_season)
+    ]
+    df = pd.concat(all_dfs, ignore_index=True)
+    return sanitize(connection, df, **kwargs)
+
+
+def iter_by_week(connection, week_loader, weeks_by_season, executor=None, max_workers=4, max_pending=None,
+                 ordered=True, **kwargs):
+    """Load weeks concurrently and yield each one sanitized, instead of one frame for all weeks.
+
+    ``week_loader`` calls run on ``executor`` (by default a thread pool of ``max_workers``);
+    pass a ``ProcessPoolExecutor`` for CPU-bound loaders, in which case ``week_loader`` must be picklable.
+    At most ``max_pending`` weeks (default ``max_workers``) are loaded or held ahead of the consumer,
+    which bounds memory to a few weeks.
+    Sanitizing happens in the calling thread, so ``connection`` is never shared between threads.
+    With ``ordered=False`` weeks are yielded as they finish loading.
+    Load and sanitize times are logged at INFO level for every week.
+
+    """
+    season_type = kwargs.pop('season_type', None)
+    if max_pending is None:
+        max_pending = max_workers
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    season_weeks = iter(_season_weeks(weeks_by_season))
+    pending = {}
+
+    def submit_next():
+        for season_year, week in islice(season_weeks, 1):
+            pending[executor.submit(_load_week, week_loader, season_year, week, season_type)] = season_year, week
+
+    try:
+        for _ in range(max_pending):
+            submit_next()
+
+        while pending:
+            if ordered:
+                future = next(iter(pending))
             else:
-                season_type = 'Regular'
+                future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+            season_year, week = pending.pop(future)
+            week_df, load_seconds = future.result()
+            submit_next()
 
-            week_df = week_loader(season_year=season_year, week=week)
-            week_df['season_year'] = season_year
-            week_df['week'] = week
-            week_df['season_type'] = season_type
-            all_dfs.append(week_df)
+            start = time.perf_counter()
+            week_df = sanitize(connection, week_df, **kwargs)
+            logger.info('%s week %s: loaded in %.2fs, sanitized in %.2fs',
+                        season_year, week, load_seconds, time.perf_counter() - start)
+            yield week_df
 
-    df = pd.concat(all_dfs, ignore_index=True)
-    return sanitize(connection, df, **kwargs)
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
 
 
 def sanitize(connection, df, idp=False, source=''):
+    with trace.span('clean columns'):
+        df = _clean(df, idp, source)
+
+    with trace.span('lookup games'):
+        df = pd.concat([
+            df,
+            lookup.gsis_ids(connection, df, lookup_home='home' not in df, lookup_opp='opp' not in df),
+        ], axis=1)
+    with trace.span('resolve players'):
+        df['player_id'] = lookup.player_index(connection).resolve(df['name'], df['pos'], df['team'])
+
+    return df.set_index(['gsis_id', 'player_id']).sort_index()
+
+
+def standardize_str(str_):
+    return str_.lower().replace(' ', '_')
+
+
+# Some columns we short-circuit in order to always keep.
+always_kept_columns = {
+    'season_year',
+    'season_type',
+    'week',
+    'team',
+    'gsis_id',
+}
+
+
+def constant_columns(df):
+    """Columns with fewer than two distinct non-null values, besides ``always_kept_columns``."""
+    return df.columns[(df.nunique() < 2) & ~df.columns.isin(always_kept_columns)]
+
+
+def all_same_or_null(series):
+    if series.name in always_kept_columns:
+        return False
+    return series.nunique() < 2
+
+
+def _clean(df, idp, source):
     df.columns = [get_column_renames().get(standardize_str(col), standardize_str(col)) for col in df.columns]
     df = df.drop(df.index[df['team'] == 'FA'], axis=0)
-    df = df.drop(
-        df.index[np.array(
-            [(row['name'], row['pos']) in get_ignored_players()
-             for _, row in df.iterrows()]),
-        ], axis=0,
-    )
+    df = df.drop(df.index[pd.MultiIndex.from_arrays([df['name'], df['pos']]).isin(get_ignored_players())], axis=0)
 
     if 'bye' in df:
         df = df.drop(df.index[df['bye'] == df['week']], axis=0)
@@ -45,7 +125,7 @@ def sanitize(connection, df, idp=False, source=''):
         df = df.drop([col for col in df if col.startswith('idp')], axis=1)
         df = df.drop(df.index[df['pos'].isin({'DL', 'LB', 'DB'})], axis=0)
 
-    df = df.drop(df.columns[df.apply(all_same_or_null)], axis=1)
+    df = df.drop(constant_columns(df), axis=1)
 
     if source.lower() == 'fantasyfootballanalytics':
         df = df.drop([
@@ -64,46 +144,33 @@ def sanitize(connection, df, idp=False, source=''):
             'kicking_fgm_40_49',
             'kicking_fgm_50p',
         ], axis=1)
+    return df
 
-    df = pd.concat([
-        df,
-        df.apply(_id_from_row(connection, lookup_home='home' not in df, lookup_opp='opp' not in df), axis=1)
-    ], axis=1)
-    df['player_id'] = [lookup.player_id(connection, row['name'], row['pos'], team=row['team'])
-                       for _, row in df.iterrows()]
 
-    return df.set_index(['gsis_id', 'player_id']).sort_index()
+def _season_weeks(weeks_by_season):
+    return [(season_year, week) for season_year, weeks in weeks_by_season.items() for week in weeks]
 
 
-def standardize_str(str_):
-    return str_.lower().replace(' ', '_')
-
-
-def all_same_or_null(series):
-    # Some columns we short-circuit in order to always keep.
-    if series.name in {
-        'season_year',
-        'season_type',
-        'week',
-        'team',
-        'gsis_id',
-    }:
-        return False
-    return len(set(series.unique()) - {np.nan}) < 2
+def _load_week(week_loader, season_year, week, season_type=None):
+    if season_type is None:
+        season_type = 'Postseason' if week > 17 else 'Regular'
 
-
-@curry
-def _id_from_row(connection, row, **kwargs):
-    return lookup.gsis_id(connection, row['season_year'], row['week'], row['team'],
-                          season_type=row['season_type'], **kwargs)
+    start = time.perf_counter()
+    week_df = week_loader(season_year=season_year, week=week)
+    week_df['season_year'] = season_year
+    week_df['week'] = week
+    week_df['season_type'] = season_type
+    return week_df, time.perf_counter() - start
 
 
 @memoize
 def get_ignored_players():
-    return [tuple(player.split('; '))
-            for player in yaml.load(resource_stream(__name__, 'data/ignored_players.yaml'))]
+    return pd.MultiIndex.from_tuples(
+        [tuple(player.split('; ')) for player in reference.load('ignored_players')],
+        names=['name', 'pos'],
+    )
 
 
 @memoize
 def get_column_renames():
-    return yaml.load(resource_stream(__name__, 'data/column_renames.yaml'))
+    return reference.load('column_renames')
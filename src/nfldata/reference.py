@@ -0,0 +1,64 @@
+"""The reference data in ``nfldata/data/*.yaml``, loaded quickly.
+
+Parsing YAML with the pure-Python loader dominates the first lookup in a short-lived process,
+so ``build`` compiles every file into ``data/reference.pickle`` along with a checksum of its source.
+``load`` uses the compiled data whenever the checksum still matches the YAML file,
+and otherwise falls back to parsing it.
+The build runs as part of ``setup.py build_py``, or by hand::
+
+    python -m nfldata.reference
+
+"""
+from functools import lru_cache
+from hashlib import sha256
+from importlib import resources
+import os
+import pickle
+
+names = ['column_renames', 'dfs_sites', 'hardcoded_player_ids', 'ignored_players', 'scoring', 'teams']
+compiled_file = 'reference.pickle'
+
+
+@lru_cache(maxsize=None)
+def load(name):
+    """The parsed contents of ``data/<name>.yaml``."""
+    source = _source(name)
+    compiled = _compiled().get(name)
+    if compiled is not None and compiled['checksum'] == sha256(source).hexdigest():
+        return compiled['data']
+    return _parse(source)
+
+
+def build(directory=None):
+    """Compile every YAML file into ``reference.pickle`` in ``directory`` (by default, the package's data)."""
+    compiled = {}
+    for name in names:
+        source = _source(name)
+        compiled[name] = dict(checksum=sha256(source).hexdigest(), data=_parse(source))
+    path = os.path.join(str(resources.files('nfldata') / 'data') if directory is None else directory, compiled_file)
+    with open(path, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    _compiled.cache_clear()
+    load.cache_clear()
+    return path
+
+
+@lru_cache(maxsize=None)
+def _compiled():
+    try:
+        return pickle.loads((resources.files('nfldata') / 'data' / compiled_file).read_bytes())
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+
+
+def _source(name):
+    return (resources.files('nfldata') / 'data' / (name + '.yaml')).read_bytes()
+
+
+def _parse(source):
+    import yaml
+    return yaml.safe_load(source)
+
+
+if __name__ == '__main__':
+    print('Wrote {}'.format(build()))
@@ -0,0 +1,161 @@
+"""Fantasy scoring, compiled into a coefficient matrix.
+
+A ruleset (see ``data/scoring.yaml``) pays points per unit of some stats,
+bonuses once a stat reaches a threshold, and team defenses by tiers of points allowed.
+``Scorer`` turns every bonus and tier into an indicator of a range of its stat,
+so any number of rulesets score a frame or an array of stats with one matrix multiply
+plus one lookup per stat with indicators::
+
+    scorer = Scorer(['draftkings', 'fanduel', 'ppr'])
+    points = scorer.score(historical.player_stats_by_game(connection))  # one column per ruleset
+    dst = Scorer('draftkings', parts=['defense']).score(historical.team_stats_by_game(connection))
+    simulated = scorer.score_array(draws, stats)  # draws[..., i] is stats[i]
+
+A ruleset can also be given as a dict, either shaped like the YAML or a plain mapping from stat to points.
+
+"""
+import numpy as np
+import pandas as pd
+
+from nfldata import reference
+
+parts = ['offense', 'defense']
+# Rows scored at a time, so each block's columns stay in cache.
+_block_rows = 2**14
+
+
+def ruleset(name):
+    """The rules of a named ruleset, with any ``extends`` resolved."""
+    rulesets = reference.load('scoring')
+    if name not in rulesets:
+        raise KeyError('Unknown scoring ruleset {!r}; choose from {}'.format(name, ', '.join(sorted(rulesets))))
+    rules = rulesets[name]
+    if 'extends' not in rules:
+        return rules
+    base = ruleset(rules['extends'])
+    merged = {}
+    for part in parts:
+        base_rules, part_rules = base.get(part, {}), rules.get(part, {})
+        merged[part] = dict(base_rules, **part_rules)
+        merged[part]['points'] = dict(base_rules.get('points', {}), **part_rules.get('points', {}))
+        merged[part]['bonuses'] = base_rules.get('bonuses', []) + part_rules.get('bonuses', [])
+    return merged
+
+
+class Scorer:
+    def __init__(self, rulesets, parts=parts):
+        """Compile ``rulesets`` (names or dicts, or a single one) using only the rules in ``parts``.
+
+        ``coefficients`` has one row per linear stat in ``stats`` and then per indicator in ``indicators``,
+        a ``(stat, at_least, below)`` range, and one column per ruleset in ``names``.
+
+        """
+        single = isinstance(rulesets, (str, dict))
+        rulesets = [rulesets] if single else list(rulesets)
+        self.names = [rules if isinstance(rules, str) else 'points' if single else 'points_{}'.format(i)
+                      for i, rules in enumerate(rulesets)]
+        compiled = [_compile(ruleset(rules) if isinstance(rules, str) else _as_rules(rules), parts)
+                    for rules in rulesets]
+
+        self.stats = list(dict.fromkeys(stat for linear, _ in compiled for stat in linear))
+        self.indicators = list(dict.fromkeys(indicator for _, indicators in compiled for indicator in indicators))
+        self.coefficients = np.zeros((len(self.stats) + len(self.indicators), len(compiled)))
+        for column, (linear, indicators) in enumerate(compiled):
+            for stat, points in linear.items():
+                self.coefficients[self.stats.index(stat), column] = points
+            for indicator, points in indicators.items():
+                self.coefficients[len(self.stats) + self.indicators.index(indicator), column] += points
+        self._tables = {stat: self._table(stat) for stat, _, _ in self.indicators}
+
+    @property
+    def inputs(self):
+        """Every stat the rulesets read."""
+        return list(dict.fromkeys(self.stats + [stat for stat, _, _ in self.indicators]))
+
+    def score(self, frame):
+        """Points under each ruleset for every row of ``frame``; stats it lacks, or has missing, count as zero.
+
+        Indicators of a missing stat are off, so points-allowed tiers only pay rows that have ``defense_ptsa``.
+
+        """
+        stats = [stat for stat in self.inputs if stat in frame]
+        values = frame[stats].to_numpy(dtype=np.float64, na_value=np.nan)
+        return pd.DataFrame(self.score_array(values, stats, missing=True), index=frame.index, columns=self.names)
+
+    def score_array(self, values, stats, missing=False):
+        """Points under each ruleset for an array whose last axis holds ``stats``.
+
+        Returns an array with that axis replaced by one per ruleset.
+        Pass ``missing=True`` if ``values`` may have NaNs, to count them as zero.
+
+        """
+        values = np.asarray(values)
+        dtype = values.dtype if values.dtype.kind == 'f' else np.float64
+        weights = np.zeros((len(stats), len(self.names)), dtype=dtype)
+        for row, stat in enumerate(self.stats):
+            if stat in stats:
+                weights[stats.index(stat)] = self.coefficients[row]
+        tables = [(stats.index(stat), edges.astype(dtype), table.astype(dtype))
+                  for stat, (edges, table) in self._tables.items() if stat in stats]
+
+        rows = values.reshape(-1, len(stats))
+        points = np.empty((len(rows), len(self.names)), dtype=dtype)
+        for start in range(0, len(rows), _block_rows):
+            block = rows[start:start + _block_rows]
+            block_points = (np.where(np.isnan(block), 0, block) if missing else block) @ weights
+            for column, edges, table in tables:
+                block_points += table.take(np.searchsorted(edges, block[:, column], side='right'), axis=0)
+            points[start:start + _block_rows] = block_points
+        return points.reshape(values.shape[:-1] + (len(self.names),))
+
+    def _table(self, stat):
+        """Edges of the ranges of ``stat``'s indicators and their points in each range between edges.
+
+        Edges end in NaN, so ``np.searchsorted(edges, value, side='right')`` picks the row of ``table``
+        for ``value``, where the first row is below every range and the last (NaN) row pays nothing.
+
+        """
+        ranges = [(row, at_least, below) for row, (name, at_least, below)
+                  in enumerate(self.indicators, len(self.stats)) if name == stat]
+        edges = np.array(sorted({edge for _, at_least, below in ranges for edge in (at_least, below)
+                                 if np.isfinite(edge)}) + [np.nan])
+        table = np.zeros((len(edges) + 1, len(self.names)))
+        for row, at_least, below in ranges:
+            table[1:-1][(edges[:-1] >= at_least) & (edges[:-1] < below)] += self.coefficients[row]
+        return edges, table
+
+
+def points(frame, weights):
+    """The linear points ``weights`` (a mapping from stat to points) give every row of ``frame``."""
+    return frame[list(weights)] @ np.array(list(weights.values()))
+
+
+def sql_expression(weights, aggregate=None):
+    """``weights`` (a mapping from stat to points) as a SQL expression, optionally of an aggregate of each stat."""
+    return ' + '.join(
+        '{}*{}'.format(points, stat if aggregate is None else '{}({})'.format(aggregate, stat))
+        for stat, points in weights.items()
+    )
+
+
+def _as_rules(rules):
+    if any(part in rules for part in parts):
+        return rules
+    return dict(offense=dict(points=rules))
+
+
+def _compile(rules, parts):
+    """Linear points by stat and indicator points by ``(stat, at_least, below)`` range."""
+    linear = {}
+    indicators = {}
+    for part in parts:
+        part_rules = rules.get(part, {})
+        for stat, points in part_rules.get('points', {}).items():
+            linear[stat] = linear.get(stat, 0) + points
+        for bonus in part_rules.get('bonuses', []):
+            indicator = (bonus['stat'], bonus['at_least'], np.inf)
+            indicators[indicator] = indicators.get(indicator, 0) + bonus['points']
+        tiers = sorted(part_rules.get('points_allowed', []))
+        for (at_least, points), (below, _) in zip(tiers, tiers[1:] + [(np.inf, None)]):
+            indicators['defense_ptsa', at_least, below] = points
+    return linear, indicators
@@ -0,0 +1,226 @@
+"""Monte Carlo simulation of a slate from projections and team stat correlations.
+
+Each game gets a draw of both teams' stats from a Gaussian copula
+whose correlation matrix combines the same-team and cross-team blocks of ``stats.full_corrs``.
+A player's stat is driven partly (``team_share`` of its variance) by its team's draw of the matching stat
+and partly by independent noise, and mapped to a lognormal marginal
+with the projected mean and a per-stat coefficient of variation.
+
+Iterations are drawn in chunks, each from its own seeded stream,
+and only fixed-size histograms and moments are kept between chunks,
+so memory does not grow with the number of iterations
+and results depend only on ``seed`` and ``chunk_size``, not on how chunks are spread across processes.
+
+"""
+import warnings
+import numpy as np
+import pandas as pd
+
+from nfldata.scoring import Scorer
+
+# Team stats that drive each player stat, when named differently.
+team_stat_for = {
+    'receiving_rec': 'passing_cmp',
+    'receiving_tar': 'passing_att',
+    'receiving_yds': 'passing_yds',
+    'receiving_tds': 'passing_tds',
+    'receiving_twoptm': 'passing_twoptm',
+}
+standard_scoring = {
+    'passing_yds': 0.04,
+    'passing_tds': 4,
+    'passing_int': -2,
+    'passing_twoptm': 2,
+    'rushing_yds': 0.1,
+    'rushing_tds': 6,
+    'rushing_twoptm': 2,
+    'receiving_yds': 0.1,
+    'receiving_tds': 6,
+    'receiving_twoptm': 2,
+    'fumbles_lost': -2,
+    'kicking_xpmade': 1,
+    'kicking_fgm': 3,
+}
+default_cv = 0.6
+quantiles = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def simulate(projections, corrs, n_iterations=10000, lineups=None, scoring=None, cv=None, team_share=0.5,
+             seed=0, chunk_size=None, max_bytes=2**28, executor=None,
+             player_bins=np.arange(-20, 100.25, 0.25), lineup_bins=np.arange(0, 400.5, 0.5)):
+    """Distributions of fantasy points for every player and (optionally) lineup on a slate.
+
+    ``projections`` is indexed by (``gsis_id``, ``player_id``) with ``team`` and ``home`` columns
+    (as from ``projected.sanitize``) and projected means of the stats in ``scoring``:
+    a ruleset name (see ``scoring.ruleset``), a dict or a ``scoring.Scorer`` of one ruleset,
+    by default ``'standard'``.
+    Offense, kicking and defense rules all apply, so team defenses (``DST``) are simulated from their
+    projected defense stats; bonuses and points-allowed tiers are paid on each simulated stat as on a real one.
+    ``corrs`` is a frame from ``stats.full_corrs``.
+    ``cv`` is a coefficient of variation, or a mapping of them by stat.
+    ``lineups`` is a frame indexed by (``lineup``, ``gsis_id``, ``player_id``), as from ``dfs.optimize``.
+
+    Chunks of ``chunk_size`` iterations (by default, as many as fit in ``max_bytes``)
+    are run on ``executor`` if given.
+    Quantiles are read from histograms with the given bin edges.
+
+    Returns a frame of points distributions per player, and one per lineup (or None).
+
+    """
+    model = _Model(projections, corrs, scoring or 'standard', cv, team_share, lineups,
+                   player_bins, lineup_bins)
+    if chunk_size is None:
+        chunk_size = max(1, max_bytes // model.bytes_per_iteration)
+    chunks = [
+        (seed, chunk, min(chunk_size, n_iterations - start))
+        for chunk, start in enumerate(range(0, n_iterations, chunk_size))
+    ]
+
+    if executor is None:
+        results = [_simulate_chunk(model, *chunk) for chunk in chunks]
+    else:
+        results = list(executor.map(_simulate_chunk, [model] * len(chunks), *zip(*chunks)))
+
+    player_totals, lineup_totals = [sum(parts) for parts in zip(*results)]
+    players = _summary(player_totals, player_bins, n_iterations, projections.index)
+    if lineups is None:
+        return players, None
+    return players, _summary(lineup_totals, lineup_bins, n_iterations, model.lineup_index)
+
+
+def nearest_psd(corr, epsilon=1e-8):
+    """The correlation matrix nearest ``corr`` (by clipping eigenvalues) that is positive definite."""
+    corr = (np.asarray(corr) + np.asarray(corr).T) / 2
+    eigenvalues, eigenvectors = np.linalg.eigh(corr)
+    repaired = eigenvectors @ np.diag(np.maximum(eigenvalues, epsilon)) @ eigenvectors.T
+    scale = np.sqrt(np.diag(repaired))
+    return repaired / np.outer(scale, scale)
+
+
+def game_corr(corrs):
+    """Correlation matrix of (home stats, away stats) from a ``full_corrs`` frame."""
+    values = np.asarray(corrs, dtype=float)
+    same = np.triu(values, 1) + np.triu(values, 1).T + np.eye(len(values))
+    cross = np.tril(values) + np.tril(values, -1).T
+    return np.block([[same, cross], [cross.T, same]])
+
+
+class _Model:
+    def __init__(self, projections, corrs, scoring, cv, team_share, lineups, player_bins, lineup_bins):
+        team_stats = list(corrs.columns)
+        scorer = scoring if isinstance(scoring, Scorer) else Scorer(scoring)
+        if len(scorer.names) != 1:
+            raise ValueError('Simulations score one ruleset at a time, not {}'.format(', '.join(scorer.names)))
+        stats = [stat for stat in scorer.inputs if stat in projections]
+        if not stats:
+            raise ValueError('Projections have none of the scored stats')
+        if cv is None or np.isscalar(cv):
+            cv = {stat: default_cv if cv is None else cv for stat in stats}
+
+        self.chol = np.linalg.cholesky(nearest_psd(game_corr(corrs)))
+        n_team_stats = len(team_stats)
+        self.n_games = projections.index.get_level_values('gsis_id').nunique()
+        self.n_players = len(projections)
+
+        # Only (player, stat) pairs with a positive projection are drawn, in player order.
+        means = projections[stats].fillna(0).clip(lower=0).values.astype(float)
+        player, stat = np.nonzero(means)
+        self.player = player
+        self.starts = np.flatnonzero(np.r_[True, player[1:] != player[:-1]]) if len(player) else player
+        self.means = means[player, stat]
+        cv_by_stat = np.array([cv.get(stat_name, default_cv) for stat_name in stats], dtype=float)
+        self.sigma = np.sqrt(np.log1p(cv_by_stat ** 2))[stat]
+        self.weights = np.array([
+            scorer.coefficients[scorer.stats.index(stat_name), 0] if stat_name in scorer.stats else 0
+            for stat_name in stats
+        ])[stat]
+        # Pairs paid each bonus (or other indicator), with its range and points.
+        self.indicators = [
+            (np.flatnonzero(stat == stats.index(stat_name)), at_least, below, points)
+            for (stat_name, at_least, below), points in zip(
+                scorer.indicators, scorer.coefficients[len(scorer.stats):, 0])
+            if stat_name in stats and points
+        ]
+
+        team_stat = np.array([
+            team_stats.index(team_stat_for.get(name, name)) if team_stat_for.get(name, name) in team_stats else -1
+            for name in stats
+        ])[stat]
+        self.team_loading = np.where(team_stat >= 0, np.sqrt(team_share), 0)
+        self.noise_loading = np.sqrt(1 - self.team_loading ** 2)
+        # Column of each pair in the flattened per-game draws: game by game, home stats before away.
+        game = pd.factorize(projections.index.get_level_values('gsis_id'))[0][player]
+        away = ~projections['home'].values.astype(bool)[player]
+        self.columns = (2 * game + away) * n_team_stats + np.maximum(team_stat, 0)
+
+        self.player_bins = player_bins
+        self.lineup_bins = lineup_bins
+        self.lineup_index = None
+        self.lineups = None
+        if lineups is not None:
+            lineup_numbers = lineups.index.get_level_values('lineup')
+            self.lineup_index = pd.Index(lineup_numbers.unique(), name='lineup')
+            rows = projections.index.get_indexer(lineups.index.droplevel('lineup'))
+            if (rows < 0).any():
+                raise ValueError('Lineups include players without projections')
+            unscored = np.setdiff1d(rows, player)
+            if len(unscored):
+                warnings.warn('Lineups include players with none of the scored stats projected, '
+                              'who always score 0: {}'.format(', '.join(str(key) for key in projections.index[unscored])))
+            self.lineups = np.zeros((len(projections), len(self.lineup_index)))
+            self.lineups[rows, self.lineup_index.get_indexer(lineup_numbers)] = 1
+
+        n_lineups = 0 if self.lineups is None else self.lineups.shape[1]
+        self.bytes_per_iteration = 8 * (5 * len(self.means) + 2 * self.n_games * len(self.chol)
+                                        + 2 * self.n_players + n_lineups)
+
+    def points(self, random, n):
+        game_draws = (random.standard_normal((n, self.n_games, len(self.chol))) @ self.chol.T).reshape(n, -1)
+        z = self.team_loading * game_draws[:, self.columns] + self.noise_loading * random.standard_normal((n, len(self.means)))
+        pair_values = self.means * np.exp(self.sigma * z - self.sigma ** 2 / 2)
+        pair_points = self.weights * pair_values
+        for pairs, at_least, below, points in self.indicators:
+            values = pair_values[:, pairs]
+            pair_points[:, pairs] += points * ((values >= at_least) & (values < below))
+        points = np.zeros((n, self.n_players))
+        if len(self.means):
+            points[:, self.player[self.starts]] = np.add.reduceat(pair_points, self.starts, axis=1)
+        return points
+
+
+def _simulate_chunk(model, seed, chunk, n):
+    random = np.random.RandomState([seed, chunk])
+    points = model.points(random, n)
+    player_totals = _accumulate(points, model.player_bins)
+    if model.lineups is None:
+        return player_totals, 0
+    return player_totals, _accumulate(points @ model.lineups, model.lineup_bins)
+
+
+def _accumulate(values, bins):
+    """Histogram counts (one row per column of ``values``, clipped to the bins) plus sums and sums of squares."""
+    n_bins = len(bins) - 1
+    ixs = np.clip(np.searchsorted(bins, values, side='right') - 1, 0, n_bins - 1)
+    counts = np.bincount(
+        (ixs + n_bins * np.arange(values.shape[1])).ravel(),
+        minlength=n_bins * values.shape[1],
+    ).reshape(values.shape[1], n_bins)
+    return np.column_stack([counts, values.sum(axis=0), (values ** 2).sum(axis=0)])
+
+
+def _summary(totals, bins, n_iterations, index):
+    counts, sums, squares = totals[:, :-2], totals[:, -2], totals[:, -1]
+    mean = sums / n_iterations
+    summary = pd.DataFrame(dict(
+        mean=mean,
+        std=np.sqrt(np.maximum(squares / n_iterations - mean ** 2, 0)),
+    ), index=index)
+
+    cumulative = np.cumsum(counts, axis=1)
+    for q in quantiles:
+        target = q * n_iterations
+        bin_ = np.argmax(cumulative >= target, axis=1)
+        below = np.where(bin_ > 0, cumulative[np.arange(len(bin_)), bin_ - 1], 0)
+        in_bin = np.maximum(counts[np.arange(len(bin_)), bin_], 1)
+        summary['p{:g}'.format(100 * q)] = bins[bin_] + (target - below) / in_bin * (bins[bin_ + 1] - bins[bin_])
+    return summary
@@ -2,42 +2,118 @@ import numpy as np
 import pandas as pd
 
 
-def same_team_corrs(data):
-    return data.corr()
+def same_team_corrs(data, pairwise=True, dtype=np.float64, chunk_size=None):
+    """Correlations between the columns of ``data``, as in ``DataFrame.corr``.
 
+    With ``pairwise`` each correlation uses the rows where both columns are present;
+    otherwise rows with any missing value are dropped.
+    ``dtype`` may be ``np.float32`` to halve memory,
+    and ``chunk_size`` limits how many columns enter each matrix product.
 
-def cross_team_corrs(data):
-    unstacked = data.unstack('home').reset_index(drop=True)
-    unstacked.columns = pd.MultiIndex.from_tuples(
-        [(stat, home) for stat, home in unstacked.columns],
-        names=['stat', 'home'],
+    """
+    values = data.values.astype(dtype)
+    return pd.DataFrame(
+        _corr(values, values, pairwise, chunk_size),
+        index=data.columns, columns=data.columns,
     )
-    unstacked = unstacked.sort_index(axis='columns', level='home', sort_remaining=False)
-    stats = unstacked.columns.get_level_values('stat')[:unstacked.shape[1]//2]
 
-    switched = unstacked.copy()
-    switched.columns = pd.MultiIndex.from_tuples(
-        [(stat, not home) for stat, home in switched.columns],
-        names=['stat', 'home'],
-    )
-    switched = switched.sort_index(axis='columns', level='home')
 
-    return (
-        pd.concat([unstacked, switched], axis=0, ignore_index=True)
-        .corr()
-        .sort_index(axis=0).sort_index(axis=1)
-        .xs(True, axis=0, level='home').xs(False, axis=1, level='home')
-        .reindex_axis(stats, axis=1).reindex_axis(stats, axis=0)
+def cross_team_corrs(data, pairwise=True, dtype=np.float64, chunk_size=None):
+    """Correlations between each team's stats (rows) and its opponent's stats (columns).
+
+    ``data`` needs a boolean ``home`` index level pairing the two teams of each game.
+    Every game counts twice, once from each team's side,
+    which is computed directly from the home/away blocks without stacking them.
+
+    """
+    unstacked = data.unstack('home')
+    home = unstacked.xs(True, axis='columns', level='home')[data.columns].values.astype(dtype)
+    away = unstacked.xs(False, axis='columns', level='home')[data.columns].values.astype(dtype)
+    return pd.DataFrame(
+        _corr(home, away, pairwise, chunk_size, both_sides=True),
+        index=data.columns, columns=data.columns,
     )
 
 
-def full_corrs(data):
+def full_corrs(data, **kwargs):
     """Same- and cross-team correlations.
     Same-team correlations are above the diagonal;
     cross-team correlations are on and below the diagonal.
 
     """
-    corr = same_team_corrs(data)
-    tril_ixs = np.tril_indices_from(corr)
-    corr.values[tril_ixs] = cross_team_corrs(data).values[tril_ixs]
-    return corr
+    corr = same_team_corrs(data, **kwargs)
+    values = corr.values.copy()
+    tril_ixs = np.tril_indices_from(values)
+    values[tril_ixs] = cross_team_corrs(data, **kwargs).values[tril_ixs]
+    return pd.DataFrame(values, index=corr.index, columns=corr.columns)
+
+
+def _corr(a, b, pairwise=True, chunk_size=None, both_sides=False):
+    """Pearson correlations between the columns of ``a`` and ``b``, whose rows are paired.
+
+    With ``both_sides``, the rows are also used in reverse,
+    i.e. as if ``a`` were ``[a; b]`` and ``b`` were ``[b; a]``.
+
+    """
+    if not pairwise:
+        complete = ~(np.isnan(a).any(axis=1) | np.isnan(b).any(axis=1))
+        a, b = a[complete], b[complete]
+
+    # Correlations are unchanged by shifting a column, and centering keeps the sums of squares small.
+    # Both sides must be shifted together since their rows are pooled.
+    if both_sides:
+        a_mean = b_mean = _nanmean(np.concatenate([a, b]))
+    else:
+        a_mean, b_mean = _nanmean(a), _nanmean(b)
+    a = a - a_mean
+    b = b - b_mean
+
+    n, sa, sb, saa, sbb, sab = _moments(a, b, chunk_size)
+    if both_sides:
+        n, sa, sb, saa, sbb, sab = n + n.T, sa + sb.T, sb + sa.T, saa + sbb.T, sbb + saa.T, sab + sab.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_product = (n * saa - sa ** 2) * (n * sbb - sb ** 2)
+        corr = (n * sab - sa * sb) / np.sqrt(var_product)
+    corr[(n < 2) | ~(var_product > 0)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def _moments(a, b, chunk_size=None):
+    """Pairwise-complete counts and sums for every pair of columns of ``a`` and ``b``."""
+    shape = a.shape[1], b.shape[1]
+    a_valid, b_valid = ~np.isnan(a), ~np.isnan(b)
+    a_zeroed, b_zeroed = np.where(a_valid, a, 0), np.where(b_valid, b, 0)
+    sab = _chunked_product(a_zeroed, b_zeroed, chunk_size)
+
+    if a_valid.all() and b_valid.all():
+        sa, saa = np.broadcast_to(a.sum(axis=0)[:, None], shape), np.broadcast_to((a ** 2).sum(axis=0)[:, None], shape)
+        sb, sbb = np.broadcast_to(b.sum(axis=0)[None, :], shape), np.broadcast_to((b ** 2).sum(axis=0)[None, :], shape)
+        return np.full(shape, a.shape[0], dtype=a.dtype), sa, sb, saa, sbb, sab
+
+    a_valid, b_valid = a_valid.astype(a.dtype), b_valid.astype(b.dtype)
+    return (
+        _chunked_product(a_valid, b_valid, chunk_size),
+        _chunked_product(a_zeroed, b_valid, chunk_size),
+        _chunked_product(a_valid, b_zeroed, chunk_size),
+        _chunked_product(a_zeroed ** 2, b_valid, chunk_size),
+        _chunked_product(a_valid, b_zeroed ** 2, chunk_size),
+        sab,
+    )
+
+
+def _chunked_product(a, b, chunk_size=None):
+    if chunk_size is None:
+        return a.T @ b
+    product = np.empty((a.shape[1], b.shape[1]), dtype=np.result_type(a, b))
+    for i in range(0, a.shape[1], chunk_size):
+        for j in range(0, b.shape[1], chunk_size):
+            product[i:i + chunk_size, j:j + chunk_size] = a[:, i:i + chunk_size].T @ b[:, j:j + chunk_size]
+    return product
+
+
+def _nanmean(values):
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    sums = np.where(valid, values, 0).sum(axis=0)
+    return np.where(counts > 0, sums / np.maximum(counts, 1), 0).astype(values.dtype)
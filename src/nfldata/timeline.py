@@ -0,0 +1,206 @@
+"""Per-play game state (clock, possession and running score) for point-in-time queries.
+
+``GameTimelines.build`` reads every play of the selected games in one query and keeps them as flat arrays,
+sorted by game and then clock, with the plays of the ``i``-th game at ``offsets[i]:offsets[i + 1]``.
+The state of a game at any moment is then a binary search rather than a query::
+
+    timelines = GameTimelines.build(connection, season_year=2016)
+    timelines.score_before('2016091100', 'Q3', 432)
+    timelines = timelines.update(connection)  # add the games played since
+    timelines.save('timelines.npz')
+
+Points are credited as in ``lookup.score_before_time``:
+offensive points to ``pos_team``, defensive and return points to the other team,
+and plays with an unknown ``pos_team`` score nothing.
+
+"""
+import numpy as np
+import pandas as pd
+
+from nfldata import db, scoring
+from nfldata.common import game_clock, time_col_clock
+from nfldata.lookup import defense_pts_by_stat, offense_pts_by_stat
+
+# Game positions are scaled by this in the combined (game, clock) search keys; clocks are far smaller.
+_game_stride = 2**32
+
+
+class GameTimelines:
+    game_arrays = ['gsis_id', 'home_team', 'away_team']
+    play_arrays = ['play_id', 'clock', 'pos_team', 'home_score', 'away_score']
+
+    def __init__(self, gsis_id, home_team, away_team, offsets, play_id, clock, pos_team, home_score, away_score):
+        """Timelines from their arrays; use ``build`` or ``load`` instead.
+
+        Games are sorted by ``gsis_id``; plays by game, then ``clock``, then ``play_id``.
+        ``home_score`` and ``away_score`` are running totals including each play's points.
+
+        """
+        self.gsis_id = np.asarray(gsis_id, dtype=str)
+        self.home_team = np.asarray(home_team, dtype=str)
+        self.away_team = np.asarray(away_team, dtype=str)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.play_id = np.asarray(play_id, dtype=np.int64)
+        self.clock = np.asarray(clock, dtype=np.int64)
+        self.pos_team = np.asarray(pos_team, dtype=str)
+        self.home_score = np.asarray(home_score, dtype=np.int16)
+        self.away_score = np.asarray(away_score, dtype=np.int16)
+        game_positions = np.repeat(np.arange(len(self.gsis_id), dtype=np.int64), np.diff(self.offsets))
+        self._keys = game_positions * _game_stride + self.clock
+
+    def __len__(self):
+        return len(self.gsis_id)
+
+    @classmethod
+    def build(cls, connection, include_preseason=True, **filters):
+        """Timelines of every game selected by ``filters`` (see ``db.game_conditions``), from two queries."""
+        conditions, params = db.game_conditions(include_preseason, **filters)
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        games = db.read_sql_query(
+            'SELECT gsis_id, home_team, away_team FROM game {} ORDER BY gsis_id'.format(where),
+            connection,
+            params=params,
+        )
+        plays = db.read_sql_query(
+            """SELECT gsis_id, play_id, time, pos_team, {} AS offense_pts, {} AS defense_pts
+                FROM play
+                INNER JOIN agg_play USING(gsis_id, drive_id, play_id)
+                {}
+                {}
+            """.format(
+                scoring.sql_expression(offense_pts_by_stat),
+                scoring.sql_expression(defense_pts_by_stat),
+                'INNER JOIN game USING(gsis_id)' if conditions else '',
+                where,
+            ),
+            connection,
+            params=params,
+        )
+        return cls.from_plays(games, plays)
+
+    @classmethod
+    def from_plays(cls, games, plays):
+        """Timelines from a frame of games (``gsis_id``, ``home_team``, ``away_team``)
+        and one of their plays (``gsis_id``, ``play_id``, ``time``, ``pos_team``, ``offense_pts``, ``defense_pts``).
+
+        """
+        games = games.sort_values('gsis_id')
+        game_positions = np.searchsorted(games['gsis_id'].values, plays['gsis_id'].values)
+        clock = time_col_clock(plays['time'])
+        order = np.lexsort([plays['play_id'].values, clock, game_positions])
+        game_positions = game_positions[order]
+        pos_team = plays['pos_team'].fillna('UNK').values[order]
+
+        home_team = games['home_team'].values[game_positions]
+        away_team = games['away_team'].values[game_positions]
+        offense_pts = plays['offense_pts'].fillna(0).values[order].astype(np.int64)
+        defense_pts = plays['defense_pts'].fillna(0).values[order].astype(np.int64)
+        home_pts = np.where(pos_team == home_team, offense_pts, 0) + np.where(pos_team == away_team, defense_pts, 0)
+        away_pts = np.where(pos_team == away_team, offense_pts, 0) + np.where(pos_team == home_team, defense_pts, 0)
+
+        offsets = np.searchsorted(game_positions, np.arange(len(games) + 1))
+        return cls(
+            games['gsis_id'].values, games['home_team'].values, games['away_team'].values, offsets,
+            plays['play_id'].values[order], clock[order], pos_team,
+            _running_totals(home_pts, offsets), _running_totals(away_pts, offsets),
+        )
+
+    def update(self, connection, **filters):
+        """New timelines with more games from ``connection``.
+
+        By default only games after the last one here are read;
+        with ``filters``, the games they select are read and replace any already here.
+
+        """
+        if not filters and len(self):
+            filters = dict(after_gsis_id=self.gsis_id[-1])
+        new = type(self).build(connection, **filters)
+        kept = self._take(np.flatnonzero(~np.isin(self.gsis_id, new.gsis_id)))
+        combined = _concat(kept, new)
+        order = np.argsort(combined.gsis_id, kind='mergesort')
+        return combined if (order == np.arange(len(order))).all() else combined._take(order)
+
+    def positions(self, gsis_ids):
+        """The position of each game in the game arrays; raises ``KeyError`` for games not here."""
+        gsis_ids = np.asarray(gsis_ids, dtype=str)
+        positions = np.searchsorted(self.gsis_id, gsis_ids).clip(max=max(len(self) - 1, 0))
+        missing = (self.gsis_id[positions] != gsis_ids) if len(self) else np.ones(len(gsis_ids), dtype=bool)
+        if missing.any():
+            raise KeyError('No timeline for games {}'.format(', '.join(sorted(set(gsis_ids[missing])))))
+        return positions
+
+    def plays_before(self, gsis_ids, clocks):
+        """Index into the play arrays of the last play strictly before each game clock, or -1 if there is none."""
+        positions = self.positions(gsis_ids)
+        keys = positions * _game_stride + np.asarray(clocks, dtype=np.int64)
+        plays = np.searchsorted(self._keys, keys, side='left') - 1
+        return np.where(plays >= self.offsets[positions], plays, -1)
+
+    def state_before(self, gsis_ids, clocks):
+        """Both teams' scores and the team with possession strictly before each game clock, one row per query."""
+        positions = self.positions(gsis_ids)
+        plays = self.plays_before(gsis_ids, clocks)
+        scored = plays >= 0
+        return pd.DataFrame(dict(
+            gsis_id=self.gsis_id[positions],
+            clock=np.asarray(clocks, dtype=np.int64),
+            home_team=self.home_team[positions],
+            away_team=self.away_team[positions],
+            home_score=np.where(scored, self.home_score[plays], 0),
+            away_score=np.where(scored, self.away_score[plays], 0),
+            pos_team=np.where(scored, self.pos_team[plays], None),
+            play_id=np.where(scored, self.play_id[plays], -1),
+        ))
+
+    def scores_before(self, gsis_ids, teams, clocks):
+        """Each team's score strictly before the given game clocks; a drop-in for ``lookup.scores_before``."""
+        state = self.state_before(gsis_ids, clocks)
+        teams = np.asarray(teams, dtype=str)
+        return np.where(teams == state['home_team'].values, state['home_score'].values, state['away_score'].values)
+
+    def score_before(self, gsis_id, before_quarter, before_time):
+        """The score strictly before a time, as ``lookup.score_before_time`` returns it."""
+        state = self.state_before([gsis_id], game_clock([before_quarter], [before_time])).iloc[0]
+        return pd.Series(
+            [int(state['home_score']), int(state['away_score'])],
+            [state['home_team'], state['away_team']],
+            name='score',
+        )
+
+    def save(self, path):
+        np.savez_compressed(path, **{name: getattr(self, name) for name in self._arrays()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in cls._arrays()})
+
+    @classmethod
+    def _arrays(cls):
+        return cls.game_arrays + ['offsets'] + cls.play_arrays
+
+    def _take(self, positions):
+        """Timelines of the games at ``positions``, in that order."""
+        counts = np.diff(self.offsets)[positions]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        plays = np.repeat(self.offsets[positions] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return type(self)(
+            offsets=offsets,
+            **{name: getattr(self, name)[positions] for name in self.game_arrays},
+            **{name: getattr(self, name)[plays] for name in self.play_arrays},
+        )
+
+
+def _running_totals(points, offsets):
+    """Cumulative sums of ``points`` that restart at each of ``offsets``."""
+    totals = np.cumsum(points)
+    starts = np.concatenate([[0], totals])[offsets[:-1]]
+    return totals - np.repeat(starts, np.diff(offsets))
+
+
+def _concat(first, second):
+    return type(first)(
+        offsets=np.concatenate([first.offsets[:-1], second.offsets + first.offsets[-1]]),
+        **{name: np.concatenate([getattr(first, name), getattr(second, name)])
+           for name in first.game_arrays + first.play_arrays},
+    )
@@ -0,0 +1,202 @@
+"""Opt-in instrumentation of nfldb queries and the pandas work around them.
+
+Inside a ``Trace``, every query through ``nfldata.db`` is recorded
+with its fingerprint (whitespace-normalized SQL with literals blanked),
+number of parameters and bound values, rows returned, latency,
+the nfldata function that ran it and the public entry point the call came through.
+Major pandas stages in ``historical``, ``lookup`` and ``projected`` are recorded as spans::
+
+    with Trace('drives.trace.json') as trace:
+        drives = historical.team_stats_by_drive(connection, vectorized=False)
+    print(trace.summary().head())
+    print(trace.repeated_queries())
+
+The trace file is in Chrome's trace-event format, viewable in ``chrome://tracing`` or Perfetto.
+Outside a ``Trace`` the hooks do nothing.
+
+"""
+from contextlib import contextmanager
+from hashlib import sha1
+import json
+import re
+import sys
+import threading
+import time
+import pandas as pd
+
+_active = []
+_literal_pattern = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_untraced_modules = {'nfldata.db', 'nfldata.cache', 'nfldata.trace'}
+_submitted = threading.local()
+
+
+def active():
+    """The innermost trace currently recording, or None."""
+    return _active[-1] if _active else None
+
+
+class Trace:
+    def __init__(self, path=None, repeat_threshold=10):
+        """Record queries and spans; on exit, write them to ``path`` if given.
+
+        Queries run at least ``repeat_threshold`` times from one entry point are flagged as repeated,
+        the sign of a per-row (N+1) query pattern.
+
+        """
+        self.path = path
+        self.repeat_threshold = repeat_threshold
+        self._queries = []
+        self._spans = []
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.remove(self)
+        if self.path is not None:
+            self.export(self.path)
+
+    @property
+    def queries(self):
+        """One row per query, in the order they finished."""
+        return pd.DataFrame(self._queries, columns=[
+            'fingerprint', 'sql', 'n_params', 'n_values', 'rows', 'start', 'seconds',
+            'caller', 'entry_point', 'thread',
+        ])
+
+    @property
+    def spans(self):
+        return pd.DataFrame(self._spans, columns=['name', 'start', 'seconds', 'caller', 'entry_point', 'thread'])
+
+    def summary(self):
+        """Queries grouped by entry point and fingerprint, most total time first."""
+        queries = self.queries
+        summary = (queries
+                   .groupby(['entry_point', 'fingerprint'], dropna=False)
+                   .agg(calls=('seconds', 'size'),
+                        total_seconds=('seconds', 'sum'),
+                        mean_seconds=('seconds', 'mean'),
+                        rows=('rows', 'sum'),
+                        callers=('caller', lambda callers: ', '.join(sorted(set(callers)))),
+                        sql=('sql', 'first'))
+                   .sort_values('total_seconds', ascending=False)
+                   )
+        summary.insert(1, 'repeated', summary['calls'] >= self.repeat_threshold)
+        return summary
+
+    def repeated_queries(self):
+        summary = self.summary()
+        return summary[summary['repeated']]
+
+    def export(self, path):
+        """Write queries and spans as Chrome trace events."""
+        events = [
+            dict(name=query['caller'] + ' ' + query['fingerprint'], cat='sql', ph='X',
+                 ts=1e6 * query['start'], dur=1e6 * query['seconds'], pid=0, tid=query['thread'],
+                 args=dict((key, query[key]) for key in ['sql', 'n_params', 'n_values', 'rows', 'entry_point']))
+            for query in self._queries
+        ] + [
+            dict(name=span['name'], cat='pandas', ph='X',
+                 ts=1e6 * span['start'], dur=1e6 * span['seconds'], pid=0, tid=span['thread'],
+                 args=dict(caller=span['caller'], entry_point=span['entry_point']))
+            for span in self._spans
+        ]
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f, default=str)
+
+
+def record_query(sql, params, result, start):
+    """Record a query that started at ``start`` (a ``time.perf_counter`` value) and just returned ``result``."""
+    trace = active()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    caller, entry_point = _callers()
+    values = (params or {}).values()
+    trace._queries.append(dict(
+        fingerprint=fingerprint(sql),
+        sql=normalize(sql),
+        n_params=len(values),
+        n_values=sum(_n_values(value) for value in values),
+        rows=len(result) if hasattr(result, '__len__') else None,
+        start=start - trace._start,
+        seconds=end - start,
+        caller=caller,
+        entry_point=entry_point,
+        thread=threading.get_ident(),
+    ))
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as a named stage of the current entry point."""
+    trace = active()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        caller, entry_point = _callers()
+        trace._spans.append(dict(
+            name=name,
+            start=start - trace._start,
+            seconds=time.perf_counter() - start,
+            caller=caller,
+            entry_point=entry_point,
+            thread=threading.get_ident(),
+        ))
+
+
+def propagate(function):
+    """``function``, attributed when called in another thread to the nfldata functions that wrapped it here."""
+    if active() is None:
+        return function
+    callers = _callers()
+
+    def attributed(*args, **kwargs):
+        _submitted.callers = callers
+        try:
+            return function(*args, **kwargs)
+        finally:
+            del _submitted.callers
+    return attributed
+
+
+def normalize(sql):
+    return ' '.join(_literal_pattern.sub('?', sql).split())
+
+
+def fingerprint(sql):
+    return sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def _n_values(value):
+    if isinstance(value, (tuple, list)):
+        return sum(_n_values(item) for item in value)
+    return 1
+
+
+def _callers():
+    """The innermost nfldata function on the stack, and the outermost public one."""
+    caller = entry_point = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        name = frame.f_code.co_name
+        if module.startswith('nfldata.') and module not in _untraced_modules and not name.startswith('<'):
+            function = '{}.{}'.format(module[len('nfldata.'):], getattr(frame.f_code, 'co_qualname', name))
+            if caller is None:
+                caller = function
+            if not name.startswith('_'):
+                entry_point = function
+        frame = frame.f_back
+    # In a worker thread (see ``propagate``), the stack above the submitted function is in the submitting thread.
+    submitted_caller, submitted_entry_point = getattr(_submitted, 'callers', (None, None))
+    caller = caller or submitted_caller
+    entry_point = submitted_entry_point or entry_point
+    return caller or '', entry_point or caller or ''